@@ -4,6 +4,8 @@
 #
 # SPDX-License-Identifier:    MIT
 
+__version__ = "0.2.10"
+
 from .packaging import repackage
 from .transpile import transpile_module
 from .utils import parsedump_ast, parsedump_source
@@ -0,0 +1,205 @@
+# This file is part of the three2six project
+# https://github.com/mbarkhau/three2six
+# (C) 2018 Manuel Barkhau <mbarkhau@gmail.com>
+#
+# SPDX-License-Identifier:    MIT
+
+import os
+import sys
+import json
+import atexit
+import sqlite3
+import typing as typ
+import functools
+import hashlib as hl
+
+from . import common
+from . import __version__
+
+
+CHECK_RESULTS_FILENAME = "check_results.sqlite3"
+
+TRANSPILE_RESULTS_DIRNAME = "transpiled"
+
+# NOTE: These only control how a build is done, they don't change
+#   the result, so they aren't part of the cache keys.
+BUILD_ONLY_CFG_KEYS = {"force_transpile", "max_workers", "cache_dir"}
+
+# NOTE: Which fixers are compatible and how the fixed tree is turned
+#   back into source (ast.unparse vs. astor) depend on the running
+#   interpreter, so results of other interpreters are not reused.
+INTERPRETER_TAG = "{}-{}.{}".format(sys.implementation.name, *sys.version_info[:2])
+
+
+@functools.lru_cache(maxsize=1)
+def _package_source_hash() -> str:
+    # NOTE: The results depend on the code of the checkers and fixers,
+    #   which may change without __version__ being bumped (e.g. during
+    #   development), so the source of the package is part of the key.
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    source_hash = hl.sha256()
+    for filename in sorted(os.listdir(package_dir)):
+        if filename.endswith(".py"):
+            with open(os.path.join(package_dir, filename), mode="rb") as fh:
+                source_hash.update(fh.read())
+    return source_hash.hexdigest()
+
+
+def _code_tag() -> str:
+    return f"{__version__}:{INTERPRETER_TAG}:{_package_source_hash()}"
+
+
+CHECK_RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS check_results (
+    key       TEXT PRIMARY KEY,
+    error_msg TEXT
+)
+"""
+
+
+def _cfg_items(cfg: common.BuildConfig) -> typ.List[typ.Tuple[str, str]]:
+    return sorted((key, val) for key, val in cfg.items() if key not in BUILD_ONLY_CFG_KEYS)
+
+
+def check_result_key(cfg: common.BuildConfig, module_source: str) -> str:
+    source_hash = hl.sha256(module_source.encode("utf-8", "surrogatepass")).hexdigest()
+    # NOTE: Checkers are passed the whole cfg, so any change to it
+    #   (other than to BUILD_ONLY_CFG_KEYS) invalidates the cached
+    #   results.
+    cfg_data = json.dumps(_cfg_items(cfg))
+    cfg_hash = hl.sha256(cfg_data.encode("utf-8")).hexdigest()
+    return f"{_code_tag()}:{source_hash}:{cfg_hash}"
+
+
+CHECK_RESULTS_BATCH_SIZE = 256
+
+# NOTE: A single connection is used per process (and cache_dir) and
+#   results are written in batches, since for small modules a commit
+#   per module would cost more than the checks themselves. The pid
+#   is part of the keys, as a connection or pending results inherited
+#   by a forked worker process must not be used.
+_connections: typ.Dict[typ.Tuple[int, str], sqlite3.Connection] = {}
+
+_pending_check_results: typ.Dict[typ.Tuple[int, str], typ.Dict[str, typ.Optional[str]]] = {}
+
+_is_flush_registered = False
+
+
+def _connection(cache_dir: str) -> sqlite3.Connection:
+    conn_key = (os.getpid(), cache_dir)
+    conn = _connections.get(conn_key)
+    if conn is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(cache_dir, CHECK_RESULTS_FILENAME))
+        with conn:
+            conn.execute(CHECK_RESULTS_SCHEMA)
+        _connections[conn_key] = conn
+    return conn
+
+
+def flush_check_results() -> None:
+    """Write check results which are pending in this process."""
+    pid = os.getpid()
+    for (pending_pid, cache_dir), pending in _pending_check_results.items():
+        if pending_pid != pid or not pending:
+            continue
+
+        # NOTE: The cache_dir may have been removed in the meantime
+        #   (e.g. a temporary directory), in which case the results
+        #   are discarded.
+        if os.path.isdir(cache_dir):
+            with _connection(cache_dir) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO check_results (key, error_msg) VALUES (?, ?)",
+                    list(pending.items()),
+                )
+        pending.clear()
+
+
+def reset_check_results() -> None:
+    """Discard pending check results, e.g. those inherited by a worker process."""
+    _pending_check_results.clear()
+
+
+def _load_check_result(cache_dir: str, key: str) -> typ.Optional[typ.Tuple[typ.Optional[str]]]:
+    pending = _pending_check_results.get((os.getpid(), cache_dir), {})
+    if key in pending:
+        return (pending[key],)
+
+    conn = _connection(cache_dir)
+    return conn.execute("SELECT error_msg FROM check_results WHERE key = ?", (key,)).fetchone()
+
+
+def _store_check_result(cache_dir: str, key: str, error_msg: typ.Optional[str]) -> None:
+    global _is_flush_registered
+    if not _is_flush_registered:
+        atexit.register(flush_check_results)
+        _is_flush_registered = True
+
+    pending = _pending_check_results.setdefault((os.getpid(), cache_dir), {})
+    pending[key] = error_msg
+    if len(pending) >= CHECK_RESULTS_BATCH_SIZE:
+        flush_check_results()
+
+
+def cached_check(cache_dir: str, key: str, check: typ.Callable[[], None]) -> None:
+    """Run check, unless a result for key was cached by a previous run.
+
+    The result of the checkers only depends on the module source,
+    the build config, the interpreter and the code of three2six
+    (see check_result_key), so for unchanged modules the checks can
+    be skipped in later builds. A cached failure raises a CheckError
+    with the original message. Results are written in batches (see
+    flush_check_results).
+    """
+    row = _load_check_result(cache_dir, key)
+    if row is not None:
+        error_msg = row[0]
+        if error_msg is None:
+            return
+        raise common.CheckError(error_msg)
+
+    try:
+        check()
+    except common.CheckError as err:
+        _store_check_result(cache_dir, key, str(err))
+        raise
+
+    _store_check_result(cache_dir, key, None)
+
+
+def transpile_result_key(cfg: common.BuildConfig, module_source_data: bytes) -> str:
+    cfg_data = json.dumps(_cfg_items(cfg)).encode("utf-8")
+    key_hash = hl.sha256(_code_tag().encode("ascii"))
+    key_hash.update(hl.sha256(cfg_data).digest())
+    key_hash.update(module_source_data)
+    return key_hash.hexdigest()
+
+
+def cached_transpile(
+    cache_dir: str, key: str, transpile: typ.Callable[[], bytes], force: bool = False
+) -> bytes:
+    """Return the output of transpile, reusing output of previous runs.
+
+    Output is stored as one file per key, so for unchanged modules
+    neither parsing nor any checks or fixers are run. Failed checks
+    are not stored, they are cached separately (see cached_check).
+    """
+    cache_path = os.path.join(cache_dir, TRANSPILE_RESULTS_DIRNAME, key[:2], key + ".py")
+    if not force:
+        try:
+            with open(cache_path, mode="rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            pass
+
+    result = transpile()
+
+    # NOTE: The result is written to a temporary file first, so
+    #   that concurrent builds never read a partially written file.
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode="wb") as fh:
+        fh.write(result)
+    os.replace(tmp_path, cache_path)
+    return result
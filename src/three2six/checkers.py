@@ -4,6 +4,7 @@
 #
 # SPDX-License-Identifier:    MIT
 
+import sys
 import ast
 import typing as typ
 
@@ -13,89 +14,183 @@ from . import utils
 
 class VersionInfo:
 
-    prohibited_until: typ.Optional[str]
+    __slots__ = ("prohibited_until", "encoded_prohibited_until")
 
-    def __init__(self, prohibited_until: str = None) -> None:
+    prohibited_until: typ.Optional[common.VersionTuple]
+    encoded_prohibited_until: typ.Optional[int]
+
+    def __init__(self, prohibited_until: common.VersionTuple = None) -> None:
         self.prohibited_until = prohibited_until
+        if prohibited_until is None:
+            self.encoded_prohibited_until = None
+        else:
+            self.encoded_prohibited_until = common.encode_version(prohibited_until)
+
+
+NodeHandler = typ.Callable[[typ.Any], None]
+
+
+# Populated by CheckerBase.__init_subclass__, so that the available
+# checkers can be looked up without introspecting the module.
+_CHECKER_CLASSES: typ.List[typ.Type["CheckerBase"]] = []
 
 
 class CheckerBase:
 
-    version_info: VersionInfo
+    # NOTE: Subclasses should declare __slots__ too (empty unless
+    #   they have instance state of their own), otherwise their
+    #   instances get a __dict__ again.
+    __slots__ = ("_dispatch",)
 
-    def is_prohibited_for(self, version: str) -> bool:
-        return (
-            self.version_info.prohibited_until is None or
-            self.version_info.prohibited_until >= version
-        )
+    version_info: typ.ClassVar[VersionInfo]
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        raise NotImplementedError()
+    # Node types for which check_node is invoked. Checkers which
+    # declare these can share a single traversal of the tree
+    # (see CombinedChecker), others must implement __call__.
+    interested_types: typ.ClassVar[common.NodeTypes] = ()
 
+    # If not empty, the checker can only fail for a module if its
+    # source contains at least one of these strings, so the check
+    # can be skipped entirely for other modules.
+    trigger_tokens: typ.ClassVar[typ.Tuple[str, ...]] = ()
 
-class VisitorCheckerBase(CheckerBase, ast.NodeVisitor):
+    # Placeholder checkers which don't check anything yet set this,
+    # so they aren't run at all.
+    is_noop: typ.ClassVar[bool] = False
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        return self.visit(tree)
+    _dispatch: typ.Dict[typ.Type[ast.AST], NodeHandler]
 
+    def __init_subclass__(cls, **kwargs: typ.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # NOTE: Helper base classes are not checkers of their own.
+        if not cls.__name__.endswith("CheckerBase"):
+            _CHECKER_CLASSES.append(cls)
 
-class NoStarImports(CheckerBase):
+    def __init__(self) -> None:
+        # Subclasses may replace this with more specific handlers,
+        # so that nodes don't have to be dispatched by isinstance.
+        self._dispatch = {node_type: self.check_node for node_type in self.interested_types}
 
-    version_info = VersionInfo()
+    def is_prohibited_for(self, version: str) -> bool:
+        prohibited_until = self.version_info.encoded_prohibited_until
+        return prohibited_until is None or prohibited_until >= common.parse_encoded_version(version)
+
+    def is_triggered_by(self, module_source: str) -> bool:
+        return not self.trigger_tokens or any(
+            token in module_source for token in self.trigger_tokens
+        )
+
+    def check_node(self, node: ast.AST) -> None:
+        raise NotImplementedError()
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        for node in ast.walk(tree):
-            if not isinstance(node, ast.ImportFrom):
-                continue
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> None:
+        if not self.interested_types:
+            raise NotImplementedError()
 
-            for alias in node.names:
-                if alias.name == "*":
-                    raise common.CheckError(f"Prohibited from {node.module} import *.")
+        # NOTE: All nodes of one type are handled before the nodes
+        #   of the next type in _dispatch.
+        index = common.get_nodes_by_type(tree)
+        for node_type, handler in self._dispatch.items():
+            for node in index.get(node_type, ()):
+                handler(node)
 
 
-class NoOverriddenStdlibImportsChecker(CheckerBase):
+class NoStarImports(CheckerBase):
+
+    __slots__ = ()
+
+    version_info = VersionInfo()
+    interested_types = (ast.ImportFrom,)
+    trigger_tokens = ("*",)
+
+    def check_node(self, node: ast.AST) -> None:
+        assert isinstance(node, ast.ImportFrom)
+        for alias in node.names:
+            if alias.name == "*":
+                raise common.CheckError(f"Prohibited from {node.module} import *.")
+
+
+def iter_binding_names(tree: ast.Module, include_plain_imports: bool = True) -> typ.Iterable[str]:
+    """Iterate over names which are defined, assigned or imported in tree.
+
+    With include_plain_imports=False, a module imported without an
+    alias (import itertools) is not considered to be an override.
+    """
+    index = common.get_nodes_by_type(tree)
+    for def_type in (ast.FunctionDef, ast.ClassDef):
+        def_nodes = typ.cast(typ.List[ast.FunctionDef], index.get(def_type, []))
+        for def_node in def_nodes:
+            yield def_node.name
+    Store = ast.Store
+    for name_node in typ.cast(typ.List[ast.Name], index.get(ast.Name, [])):
+        if type(name_node.ctx) is Store:
+            yield name_node.id
+    for alias_node in typ.cast(typ.List[ast.alias], index.get(ast.alias, [])):
+        if alias_node.asname:
+            yield alias_node.asname
+        elif include_plain_imports:
+            yield alias_node.name
+    for arg_node in typ.cast(typ.List[ast.arg], index.get(ast.arg, [])):
+        yield arg_node.arg
+
+
+def get_binding_names(tree: ast.Module, include_plain_imports: bool = True) -> typ.FrozenSet[str]:
+    """Get the set of names from iter_binding_names.
+
+    The set is stored on the tree, so that it is only built once,
+    even if multiple checkers use it.
+    """
+    cache_attr = "_three2six_binding_names_" + ("all" if include_plain_imports else "aliased")
+    names: typ.Optional[typ.FrozenSet[str]] = getattr(tree, cache_attr, None)
+    if names is None:
+        names = frozenset(iter_binding_names(tree, include_plain_imports))
+        setattr(tree, cache_attr, names)
+    return names
+
+
+class OverriddenNamesCheckerBase(CheckerBase):
+
+    __slots__ = ()
+
+    interested_types = (
+        ast.FunctionDef,
+        ast.ClassDef,
+        ast.Name,
+        ast.alias,
+        ast.arg,
+    )
+
+
+class NoOverriddenStdlibImportsChecker(OverriddenNamesCheckerBase):
     """Don't override names that fixers may reference."""
 
+    __slots__ = ()
+
     version_info = VersionInfo()
-    prohibited_import_overrides = {"itertools", "six", "builtins"}
-
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                name_in_scope = node.name
-            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
-                name_in_scope = node.id
-            elif isinstance(node, ast.alias) and node.asname:
-                name_in_scope = node.asname
-            elif isinstance(node, ast.arg):
-                name_in_scope = node.arg
-            else:
-                continue
+    prohibited_import_overrides: typ.ClassVar[typ.FrozenSet[str]] = frozenset({
+        "itertools", "six", "builtins",
+    })
 
-            if name_in_scope and name_in_scope in self.prohibited_import_overrides:
-                raise common.CheckError(f"Prohibited override of import '{name_in_scope}'")
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> None:
+        names = get_binding_names(tree, include_plain_imports=False)
+        overrides = names & self.prohibited_import_overrides
+        if overrides:
+            raise common.CheckError(f"Prohibited override of import '{min(overrides)}'")
 
 
-class NoOverriddenBuiltinsChecker(CheckerBase):
+class NoOverriddenBuiltinsChecker(OverriddenNamesCheckerBase):
     """Don't override names that fixers may reference."""
 
-    version_info = VersionInfo()
+    __slots__ = ()
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                name_in_scope = node.name
-            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
-                name_in_scope = node.id
-            elif isinstance(node, ast.alias):
-                name_in_scope = node.name if node.asname is None else node.asname
-            elif isinstance(node, ast.arg):
-                name_in_scope = node.arg
-            else:
-                continue
+    version_info = VersionInfo()
+    prohibited_builtin_overrides: typ.ClassVar[typ.FrozenSet[str]] = common.BUILTIN_NAMES
 
-            if name_in_scope and name_in_scope in common.BUILTIN_NAMES:
-                raise common.CheckError(f"Prohibited override of builtin '{name_in_scope}'")
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> None:
+        names = get_binding_names(tree)
+        overrides = names & self.prohibited_builtin_overrides
+        if overrides:
+            raise common.CheckError(f"Prohibited override of builtin '{min(overrides)}'")
 
 
 MODULE_BACKPORTS = {
@@ -116,140 +211,226 @@ MODULE_BACKPORTS = {
 
 class NoThreeOnlyImports(CheckerBase):
 
-    version_info = VersionInfo(prohibited_until="2.7")
+    __slots__ = ()
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
+    version_info = VersionInfo(prohibited_until=(2, 7))
+    is_noop = True
+
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> None:
         pass
 
 
-PROHIBITED_OPEN_ARGUMENTS = {"encoding", "errors", "newline", "closefd", "opener"}
+if sys.version_info >= (3, 8):
+    def _str_const_value(node: ast.expr) -> typ.Optional[str]:
+        # NOTE: Since py38, ast.Str is a deprecated alias, string
+        #   literals are parsed as ast.Constant.
+        if type(node) is ast.Constant and isinstance(node.value, str):
+            return node.value
+        return None
+else:
+    def _str_const_value(node: ast.expr) -> typ.Optional[str]:
+        if type(node) is ast.Str:
+            return node.s
+        return None
+
+
+PROHIBITED_OPEN_ARGUMENTS = frozenset({"encoding", "errors", "newline", "closefd", "opener"})
+
+OPEN_MODE_NODE_ERROR_MSG = (
+    "Prohibited value for argument 'mode' of builtin.open. "
+    "Expected ast.Str node, got: {}"
+)
+OPEN_POSITIONAL_ARGS_ERROR_MSG = "Prohibited positional arguments to builtin.open"
+OPEN_KEYWORD_ERROR_MSG = "Prohibited keyword argument '{}' to builtin.open."
+OPEN_MODE_VALUE_ERROR_MSG = (
+    "Prohibited value '{}' for argument 'mode' of builtin.open. "
+    "Only binary modes are allowed, use io.open as an alternative."
+)
+
+
+def _open_mode(mode_node: ast.expr) -> str:
+    mode = _str_const_value(mode_node)
+    if mode is None:
+        raise common.CheckError(OPEN_MODE_NODE_ERROR_MSG.format(mode_node))
+    return mode
 
 
 class NoOpenWithEncodingChecker(CheckerBase):
 
-    version_info = VersionInfo(prohibited_until="2.7")
+    __slots__ = ()
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        for node in ast.walk(tree):
-            if not isinstance(node, ast.Call):
-                continue
+    version_info = VersionInfo(prohibited_until=(2, 7))
+    interested_types = (ast.Call,)
+    trigger_tokens = ("open",)
 
-            func_node = node.func
-            if not isinstance(func_node, ast.Name):
-                continue
-            if func_node.id != "open" or not isinstance(func_node.ctx, ast.Load):
-                continue
+    def check_node(self, node: ast.AST) -> None:
+        assert isinstance(node, ast.Call)
 
-            mode = "r"
-            if len(node.args) >= 2:
-                mode_node = node.args[1]
-                if isinstance(mode_node, ast.Str):
-                    mode = mode_node.s
-                else:
-                    raise common.CheckError(
-                        "Prohibited value for argument 'mode' of builtin.open. " +
-                        f"Expected ast.Str node, got: {mode_node}"
-                    )
+        # NOTE: Most calls are not to open, so these are checked
+        #   first and as cheaply as possible.
+        func_node = node.func
+        if type(func_node) is not ast.Name:
+            return
+        if func_node.id != "open" or type(func_node.ctx) is not ast.Load:
+            return
 
-            if len(node.args) > 3:
-                raise common.CheckError(
-                    f"Prohibited positional arguments to builtin.open"
-                )
+        mode = "r"
+        if len(node.args) >= 2:
+            mode = _open_mode(node.args[1])
 
-            for kw in node.keywords:
-                if kw.arg in PROHIBITED_OPEN_ARGUMENTS:
-                    raise common.CheckError(
-                        f"Prohibited keyword argument '{kw.arg}' to builtin.open."
-                    )
-                if kw.arg != "mode":
-                    continue
+        if len(node.args) > 3:
+            raise common.CheckError(OPEN_POSITIONAL_ARGS_ERROR_MSG)
 
-                mode_node = kw.value
-                if isinstance(mode_node, ast.Str):
-                    mode = mode_node.s
-                else:
-                    raise common.CheckError(
-                        "Prohibited value for argument 'mode' of builtin.open. " +
-                        f"Expected ast.Str node, got: {mode_node}"
-                    )
+        if node.keywords:
+            # NOTE: Repeated keyword arguments are a SyntaxError, so
+            #   no keyword is lost here. A kw.arg of None is a **kwargs
+            #   argument, which can't be checked statically.
+            keywords = {kw.arg: kw for kw in node.keywords if kw.arg is not None}
+            prohibited_keywords = keywords.keys() & PROHIBITED_OPEN_ARGUMENTS
+            if prohibited_keywords:
+                raise common.CheckError(OPEN_KEYWORD_ERROR_MSG.format(min(prohibited_keywords)))
 
-            if "b" not in mode:
-                raise common.CheckError(
-                    f"Prohibited value '{mode}' for argument 'mode' of builtin.open. " +
-                    "Only binary modes are allowed, use io.open as an alternative."
-                )
+            mode_kw = keywords.get("mode")
+            if mode_kw is not None:
+                mode = _open_mode(mode_kw.value)
+
+        if "b" not in mode:
+            raise common.CheckError(OPEN_MODE_VALUE_ERROR_MSG.format(mode))
 
 
-ASYNC_AWAIT_NODE_TYPES = (
+ASYNC_AWAIT_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = frozenset({
     ast.AsyncFor,
     ast.AsyncWith,
     ast.AsyncFunctionDef,
     ast.Await,
-)
+})
 
 
 class NoAsyncAwait(CheckerBase):
 
-    version_info = VersionInfo(prohibited_until="3.4")
+    __slots__ = ()
+
+    version_info = VersionInfo(prohibited_until=(3, 4))
+    interested_types = tuple(ASYNC_AWAIT_NODE_TYPES)
+    trigger_tokens = ("async", "await")
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        for node in ast.walk(tree):
-            if isinstance(node, ASYNC_AWAIT_NODE_TYPES):
-                raise common.CheckError("Prohibited use of async/await")
+    def check_node(self, node: ast.AST) -> None:
+        raise common.CheckError("Prohibited use of async/await")
 
 
 class NoComplexNamedTuple(CheckerBase):
 
-    version_info = VersionInfo(prohibited_until="3.4")
-
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
-        _typing_module_name: typ.Optional[str] = None
-        _namedtuple_class_name: str = "NamedTuple"
-
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import):
-                for alias in node.names:
-                    if alias.name == "typing":
-                        if alias.asname is None:
-                            _typing_module_name = alias.name
-                        else:
-                            _typing_module_name = alias.asname
-
-            if isinstance(node, ast.ImportFrom) and node.module == "typing":
-                for alias in node.names:
-                    if alias.name == "NamedTuple":
-                        if alias.asname is None:
-                            _namedtuple_class_name = alias.name
-                        else:
-                            _namedtuple_class_name = alias.asname
-
-            if not isinstance(node, ast.ClassDef):
-                continue
-
-            if not (_typing_module_name or _namedtuple_class_name):
-                continue
-
-            if not utils.has_base_class(node, _typing_module_name, _namedtuple_class_name):
-                continue
-
-            for subnode in node.body:
-                if isinstance(subnode, ast.AnnAssign):
-                    if subnode.value:
-                        tgt = subnode.target
-                        assert isinstance(tgt, ast.Name)
-                        raise common.CheckError(
-                            f"Prohibited use of default value " +
-                            f"for field '{tgt.id}' of class '{node.name}'"
-                        )
-                elif isinstance(subnode, ast.FunctionDef):
-                    raise common.CheckError(
-                        f"Prohibited definition of method " +
-                        f"'{subnode.name}' for class '{node.name}'"
-                    )
+    __slots__ = ("_typing_module_name", "_namedtuple_class_name")
+
+    version_info = VersionInfo(prohibited_until=(3, 4))
+    interested_types = (ast.Import, ast.ImportFrom, ast.ClassDef)
+    trigger_tokens = ("NamedTuple",)
+
+    _typing_module_name: typ.Optional[str]
+    _namedtuple_class_name: str
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._typing_module_name = None
+        self._namedtuple_class_name = "NamedTuple"
+        # NOTE: Handlers are invoked by node type, in the order of
+        #   _dispatch (see CheckerBase.__call__), not in the order of
+        #   the nodes in the tree. All imports are processed before
+        #   any class definitions, wherever they are in the module.
+        self._dispatch = {
+            ast.Import    : self._check_import,
+            ast.ImportFrom: self._check_import_from,
+            ast.ClassDef  : self._check_class_def,
+        }
+
+    def _check_import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            if alias.name == "typing":
+                if alias.asname is None:
+                    self._typing_module_name = alias.name
                 else:
+                    self._typing_module_name = alias.asname
+
+    def _check_import_from(self, node: ast.ImportFrom) -> None:
+        if node.module != "typing":
+            return
+
+        for alias in node.names:
+            if alias.name == "NamedTuple":
+                if alias.asname is None:
+                    self._namedtuple_class_name = alias.name
+                else:
+                    self._namedtuple_class_name = alias.asname
+
+    def _check_class_def(self, node: ast.ClassDef) -> None:
+        if not (self._typing_module_name or self._namedtuple_class_name):
+            return
+
+        if not utils.has_base_class(node, self._typing_module_name, self._namedtuple_class_name):
+            return
+
+        for subnode in node.body:
+            if isinstance(subnode, ast.AnnAssign):
+                if subnode.value:
+                    tgt = subnode.target
+                    assert isinstance(tgt, ast.Name)
                     raise common.CheckError(
-                        f"Unexpected subnode defined for class {node.name}: {subnode}"
+                        f"Prohibited use of default value " +
+                        f"for field '{tgt.id}' of class '{node.name}'"
                     )
+            elif isinstance(subnode, ast.FunctionDef):
+                raise common.CheckError(
+                    f"Prohibited definition of method " +
+                    f"'{subnode.name}' for class '{node.name}'"
+                )
+            else:
+                raise common.CheckError(
+                    f"Unexpected subnode defined for class {node.name}: {subnode}"
+                )
+
+
+class CombinedChecker:
+    """Run multiple checkers using a single traversal of the tree.
+
+    The tree is walked once to build an index of its nodes by type
+    (see common.get_nodes_by_type), which is then shared by all
+    checkers, so each checker only visits the nodes of the types
+    it is interested in.
+    """
+
+    __slots__ = ("checkers",)
+
+    checkers: typ.List[CheckerBase]
+
+    def __init__(self, checkers: typ.Iterable[CheckerBase]) -> None:
+        self.checkers = list(checkers)
+
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> None:
+        if not self.checkers:
+            # e.g. all checkers were skipped due to their trigger_tokens
+            return
+
+        index = common.get_nodes_by_type(tree)
+
+        # NOTE: Since the first CheckError aborts the build, the
+        #   checkers with the fewest nodes to visit are run first.
+        #   Checkers without interested_types may do arbitrary work
+        #   in their __call__, so they are run last.
+        costed_checkers: typ.List[typ.Tuple[float, int, CheckerBase]] = []
+        for i, checker in enumerate(self.checkers):
+            node_types = checker.interested_types
+            if node_types:
+                cost = sum(len(index.get(node_type, ())) for node_type in node_types)
+                if cost == 0:
+                    # none of the nodes the checker is interested in are in the tree
+                    continue
+                costed_checkers.append((cost, i, checker))
+            else:
+                costed_checkers.append((float("inf"), i, checker))
+
+        costed_checkers.sort()
+        for _, _, checker in costed_checkers:
+            checker(cfg, tree)
 
 
 # NOTE (mb 2018-06-24): I don't know how this could be done reliably.
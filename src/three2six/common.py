@@ -4,12 +4,16 @@
 #
 # SPDX-License-Identifier:    MIT
 
+import sys
 import ast
 import builtins
 import typing as typ
+import functools
+import collections
 
 PackageDir = typ.Dict[str, str]
 BuildConfig = typ.Dict[str, str]
+VersionTuple = typ.Tuple[int, ...]
 
 
 class InvalidPackage(Exception):
@@ -34,6 +38,136 @@ class FixerError(Exception):
         self.module = module
 
 
+@functools.lru_cache(maxsize=32)
+def parse_version(version: str) -> VersionTuple:
+    """Parse a version string such as "2.7" into a tuple (2, 7).
+
+    Versions must be compared as tuples, since for strings
+    "3.10" < "3.4".
+    """
+    return tuple(int(part) for part in version.strip().split("."))
+
+
+def encode_version(version: VersionTuple) -> int:
+    """Encode the major and minor parts of version as an int.
+
+    (2, 7) -> 2007, (3, 10) -> 3010. Encoded versions can be
+    compared with a single int comparison, rather than comparing
+    tuples element by element. Patch versions are ignored.
+    """
+    major = version[0]
+    minor = version[1] if len(version) > 1 else 0
+    return major * 1000 + minor
+
+
+@functools.lru_cache(maxsize=32)
+def parse_encoded_version(version: str) -> int:
+    return encode_version(parse_version(version))
+
+
+NodeTypes = typ.Tuple[typ.Type[ast.AST], ...]
+
+
+if sys.version_info >= (3, 8):
+    CONSTANT_NODE_TYPES: NodeTypes = (ast.Constant,)
+else:
+    CONSTANT_NODE_TYPES = (ast.Num, ast.Str, ast.Bytes, ast.NameConstant, ast.Ellipsis)
+
+
+# NOTE: These nodes have no children which any of the checkers
+#   could be interested in, so we don't descend into them.
+#   Expressions in general can't be skipped, since they may
+#   contain bindings (lambda args, comprehension targets, etc.).
+LEAF_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = frozenset(
+    CONSTANT_NODE_TYPES + tuple(
+        node_type
+        for base_type in (ast.expr_context, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
+        for node_type in base_type.__subclasses__()
+    )
+)
+
+
+def iter_nodes(
+    tree: ast.AST, skip_types: typ.FrozenSet[typ.Type[ast.AST]] = LEAF_NODE_TYPES
+) -> typ.Iterable[ast.AST]:
+    """Iterate over the nodes of tree, in the same order as ast.walk.
+
+    Nodes whose type is in skip_types are neither yielded nor
+    descended into.
+    """
+    # NOTE: This is an inlined version of ast.iter_child_nodes,
+    #   which avoids the overhead of a nested generator per node.
+    #   Globals and builtins used in the loop are bound to locals
+    #   (except isinstance, which mypy needs for type narrowing).
+    AST = ast.AST
+    _getattr = getattr
+    _type = type
+    todo = collections.deque([tree])
+    append = todo.append
+    popleft = todo.popleft
+    while todo:
+        node = popleft()
+        yield node
+        for field_name in node._fields:
+            field = _getattr(node, field_name, None)
+            if isinstance(field, list):
+                for item in field:
+                    if isinstance(item, AST) and _type(item) not in skip_types:
+                        append(item)
+            elif isinstance(field, AST) and _type(field) not in skip_types:
+                append(field)
+
+
+# Fields of statements which contain nested statements (or
+# ast.excepthandler/ast.match_case nodes, which in turn contain
+# statements).
+STMT_LIST_FIELDS = ("body", "orelse", "finalbody", "handlers", "cases")
+
+
+def iter_stmts(tree: ast.AST) -> typ.Iterable[ast.AST]:
+    """Iterate over all statements of tree, without visiting any expressions."""
+    todo = collections.deque([tree])
+    extend = todo.extend
+    while todo:
+        node = todo.popleft()
+        yield node
+        for field_name in STMT_LIST_FIELDS:
+            field = getattr(node, field_name, None)
+            # NOTE: Lambda.body and IfExp.body are expressions, not lists
+            if isinstance(field, list):
+                extend(field)
+
+
+NodeIndex = typ.Dict[typ.Type[ast.AST], typ.List[ast.AST]]
+
+
+def get_nodes_by_type(tree: ast.Module) -> NodeIndex:
+    """Get the nodes of tree grouped by their type.
+
+    The index is built with a single traversal on the first call
+    and stored on the tree, so that subsequent calls (by other
+    checkers for example) are O(1). Nodes of LEAF_NODE_TYPES are
+    not included.
+
+    NOTE: The index is not updated if the tree is modified, so it
+      should only be used before any fixers have been applied.
+    """
+    index: typ.Optional[NodeIndex] = getattr(tree, "_three2six_index", None)
+    if index is None:
+        index = {}
+        index_get = index.get
+        _type = type
+        for node in iter_nodes(tree):
+            node_type = _type(node)
+            nodes = index_get(node_type)
+            if nodes is None:
+                index[node_type] = [node]
+            else:
+                nodes.append(node)
+        setattr(tree, "_three2six_index", index)
+    return index
+
+
 # NOTE (mb 2018-06-29): None of the fixers use asname. If a
 #   module already has an import using asname, it won't be
 #   detected as already imported, and another import (without the
@@ -49,7 +183,7 @@ class ImportDecl(typ.NamedTuple):
 #   replaced it with something other than the old builtin.
 #   For example replace range -> xrange, so it would be nice if
 #   xrange isn't a string or something.
-BUILTIN_NAMES = {
+_KNOWN_BUILTIN_NAMES = (
     "ArithmeticError",
     "AssertionError",
     "AttributeError",
@@ -210,12 +344,15 @@ BUILTIN_NAMES = {
     "unichr",
     "unicode",
     "xrange",
-}
-
-# In case somebody is working on py4k or something
+)
 
-BUILTIN_NAMES.update([
-    name
-    for name in dir(builtins)
+# NOTE: The names of the running interpreter are added, in case
+#   somebody is working on py4k or something. Identifiers in a parsed
+#   ast are interned, so with interned names here, set lookups can
+#   compare by identity rather than comparing string contents.
+BUILTIN_NAMES: typ.FrozenSet[str] = frozenset(
+    sys.intern(name)
+    for names in (_KNOWN_BUILTIN_NAMES, dir(builtins))
+    for name in names
     if not name.startswith("__")
-])
+)
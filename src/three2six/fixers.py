@@ -7,28 +7,91 @@
 import sys
 import ast
 import typing as typ
+import collections
 
 from . import common
 from . import utils
 
 
+# NOTE: Contexts and operators have no fields, so a single
+#   instance can be shared by all nodes which are generated by
+#   fixers (ast.parse does the same since py39). Generated
+#   ast.Name nodes are not shared like this, since a node that
+#   occurs in multiple places of a tree would be changed in all
+#   of them when only one place is meant to be changed.
+_LOAD = ast.Load()
+_STORE = ast.Store()
+_ADD = ast.Add()
+
+_IMPORT_ITERTOOLS = common.ImportDecl("itertools", None)
+
+
 ContainerNodes = (ast.List, ast.Set, ast.Tuple)
-ImmutableValueNodes = (ast.Num, ast.Str, ast.Bytes, ast.NameConstant)
-LeafNodes = (
-    ast.Num, ast.Str, ast.Bytes, ast.NameConstant, ast.Name,
-    ast.cmpop, ast.boolop, ast.operator, ast.unaryop, ast.expr_context,
+
+# NOTE: Node types can't be subclassed in a parsed tree, so these
+#   are sets of concrete types, to be tested with type(node) in ...
+#   which is cheaper than isinstance with a tuple of types.
+
+IMMUTABLE_VALUE_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = frozenset(
+    common.CONSTANT_NODE_TYPES
 )
-ArgUnpackNodes = (ast.Call, ast.List, ast.Tuple, ast.Set)
-KwArgUnpackNodes = (ast.Call, ast.Dict)
+LEAF_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = common.LEAF_NODE_TYPES | {ast.Name}
+ARG_UNPACK_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = frozenset({
+    ast.Call, ast.List, ast.Tuple, ast.Set,
+})
+KWARG_UNPACK_NODE_TYPES: typ.FrozenSet[typ.Type[ast.AST]] = frozenset({ast.Call, ast.Dict})
+
+# NOTE: These fields only ever hold identifiers, numbers, flags or
+#   leaf nodes (ctx/op), so they never have to be walked.
+NON_WALKABLE_FIELD_NAMES: typ.FrozenSet[str] = frozenset({
+    "ctx", "op", "id", "name", "arg", "attr", "n", "s", "level",
+    "module", "kind", "is_async", "type_comment", "conversion",
+})
+
+_WALKABLE_FIELDS_CACHE: typ.Dict[typ.Type[ast.AST], typ.Tuple[str, ...]] = {}
+
+# NOTE: A field of a node type either always holds a list or never
+#   does, so this is only checked once per (node type, field name).
+_LIST_FIELDS_CACHE: typ.Dict[typ.Tuple[typ.Type[ast.AST], str], bool] = {}
+
+
+def walkable_field_names(node_type: typ.Type[ast.AST]) -> typ.Tuple[str, ...]:
+    field_names = _WALKABLE_FIELDS_CACHE.get(node_type)
+    if field_names is None:
+        field_names = tuple(
+            field_name
+            for field_name in node_type._fields
+            if field_name not in NON_WALKABLE_FIELD_NAMES
+        )
+        _WALKABLE_FIELDS_CACHE[node_type] = field_names
+    return field_names
 
 
 class VersionInfo:
 
+    __slots__ = (
+        "apply_since",
+        "apply_until",
+        "works_since",
+        "works_until",
+        "apply_since_version",
+        "apply_until_version",
+        "works_since_version",
+        "works_until_version",
+    )
+
     apply_since: str
     apply_until: str
     works_since: str
     works_until: typ.Optional[str]
 
+    # Parsed versions, so that comparisons are numeric
+    # ("3.10" < "3.4" as strings).
+    apply_since_version: common.VersionTuple
+    apply_until_version: common.VersionTuple
+    works_since_version: common.VersionTuple
+    works_until_version: typ.Optional[common.VersionTuple]
+
     def __init__(
         self, apply_since: str, apply_until: str, works_since: str=None, works_until: str=None,
     ) -> None:
@@ -43,49 +106,265 @@ class VersionInfo:
             self.works_since = works_since
         self.works_until = works_until
 
+        self.apply_since_version = common.parse_version(self.apply_since)
+        self.apply_until_version = common.parse_version(self.apply_until)
+        self.works_since_version = common.parse_version(self.works_since)
+        if self.works_until is None:
+            self.works_until_version = None
+        else:
+            self.works_until_version = common.parse_version(self.works_until)
+
+
+# Populated by FixerBase.__init_subclass__, so that the available
+# fixers can be looked up without introspecting the module.
+_FIXER_CLASSES: typ.List[typ.Type["FixerBase"]] = []
+
 
 class FixerBase:
 
+    # NOTE: Subclasses should declare __slots__ too (empty unless
+    #   they have instance state of their own), otherwise their
+    #   instances get a __dict__ again. Subclasses of
+    #   TransformerFixerBase have a __dict__ regardless, since
+    #   ast.NodeTransformer doesn't declare __slots__.
+    __slots__ = ("required_imports", "module_declarations")
+
     version_info: VersionInfo
     required_imports: typ.Set[common.ImportDecl]
     module_declarations: typ.Set[str]
 
+    # The fixer is only applied if one of these occurs in the module
+    # source (as with checkers). Empty means it is always applied.
+    trigger_tokens: typ.ClassVar[typ.Tuple[str, ...]] = ()
+
+    def __init_subclass__(cls, **kwargs: typ.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # NOTE: Helper base classes are not fixers of their own.
+        if not cls.__name__.endswith("FixerBase"):
+            _FIXER_CLASSES.append(cls)
+
     def __init__(self) -> None:
         self.required_imports = set()
         self.module_declarations = set()
 
+    def reset(self) -> None:
+        """Clear state from a previous module, so the fixer can be reused."""
+        self.required_imports.clear()
+        self.module_declarations.clear()
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         raise NotImplementedError()
 
-    def is_required_for(self, version: str) -> bool:
-        nfo = self.version_info
-        return nfo.apply_since <= version <= nfo.apply_until
+    # NOTE: The version checks only depend on the class, so they
+    #   can be done before a fixer is instantiated.
+
+    @classmethod
+    def is_required_for(cls, version: str) -> bool:
+        nfo = cls.version_info
+        version_tuple = common.parse_version(version)
+        return nfo.apply_since_version <= version_tuple <= nfo.apply_until_version
 
-    def is_compatible_with(self, version: str) -> bool:
-        nfo = self.version_info
+    @classmethod
+    def is_compatible_with(cls, version: str) -> bool:
+        nfo = cls.version_info
+        version_tuple = common.parse_version(version)
         return (
-            nfo.works_since <= version and (
-                nfo.works_until is None or version <= nfo.works_until
+            nfo.works_since_version <= version_tuple and (
+                nfo.works_until_version is None or version_tuple <= nfo.works_until_version
             )
         )
 
-    def is_applicable_to(self, src_version: str, tgt_version: str) -> bool:
+    @classmethod
+    def is_applicable_to(cls, src_version: str, tgt_version: str) -> bool:
         return (
-            self.is_compatible_with(src_version) and
-            self.is_required_for(tgt_version)
+            cls.is_compatible_with(src_version) and
+            cls.is_required_for(tgt_version)
+        )
+
+    def is_triggered_by(self, module_source: str) -> bool:
+        return not self.trigger_tokens or any(
+            token in module_source for token in self.trigger_tokens
         )
 
+    def has_fix_targets(self, tree: ast.Module) -> bool:
+        """Check if tree has any nodes the fixer may change.
+
+        This uses the node index of the unmodified tree, so it must
+        be called before any fixers are applied. Fixers for which
+        this is cheap to determine override it, so they can be
+        skipped for most modules.
+        """
+        return True
+
 
 class TransformerFixerBase(FixerBase, ast.NodeTransformer):
+    """Base for fixers implemented with visit_<NodeType> methods.
+
+    The visit_* methods are applied by a FusedFixerPass, so that
+    multiple fixers can share a single traversal of the tree. A
+    visit_* method must return a node (either the visited node or
+    its replacement) and should not recurse into the children of
+    the node, they are visited regardless. Unlike with
+    ast.NodeTransformer, a node can't be removed by returning None,
+    nor replaced by a list of nodes, doing so raises a FixerError.
+    """
+
+    # If set, visit_Name is only called for ast.Name nodes with one
+    # of these ids, which FusedFixerPass can look up by id rather
+    # than calling every visit_Name method for every name.
+    name_ids: typ.ClassVar[typ.Optional[typ.FrozenSet[str]]] = None
+
+    _visitor_names: typ.ClassVar[typ.Dict[typ.Type[ast.AST], str]] = {}
+
+    def __init_subclass__(cls, **kwargs: typ.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._visitor_names = {
+            getattr(ast, attr_name[len("visit_"):]): attr_name
+            for attr_name in dir(cls)
+            if attr_name.startswith("visit_") and (
+                # e.g. ast.NodeVisitor.visit_Constant
+                getattr(cls, attr_name) is not getattr(ast.NodeTransformer, attr_name, None)
+            )
+        }
+
+    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
+        return FusedFixerPass([self])(cfg, tree)
+
+
+FixerHook = typ.Callable[[typ.Any], typ.Any]
+
+
+class FusedFixerPass:
+    """Apply the visit_* methods of multiple fixers in a single traversal.
+
+    Nodes are visited depth first, each node before its children,
+    which is the same order as with ast.NodeTransformer.visit. The
+    visit_* methods for the type of a node are called in the order
+    of the fixers. If one of them returns a node of a different
+    type, the remaining ones are not called for that node.
+
+    If all of the hooks are for statements (or the module), only the
+    fields which contain statements are traversed, since statements
+    never occur inside of expressions.
+    """
+
+    fixers: typ.List[TransformerFixerBase]
+    hooks: typ.Dict[typ.Type[ast.AST], typ.List[FixerHook]]
+    skip_types: typ.FrozenSet[typ.Type[ast.AST]]
+    stmts_only: bool
+
+    # visit_Name methods with the name_ids of their fixer
+    name_hook_targets: typ.List[typ.Tuple[FixerHook, typ.Optional[typ.FrozenSet[str]]]]
+    # visit_Name methods by ast.Name.id, populated lazily
+    name_hooks: typ.Dict[str, typ.List[FixerHook]]
+
+    def __init__(self, fixers: typ.Iterable[TransformerFixerBase]) -> None:
+        self.fixers = list(fixers)
+        self.hooks = collections.defaultdict(list)
+        self.name_hook_targets = []
+        self.name_hooks = {}
+        for fixer in self.fixers:
+            for node_type, attr_name in fixer._visitor_names.items():
+                hook = getattr(fixer, attr_name)
+                if node_type is ast.Name:
+                    self.name_hook_targets.append((hook, fixer.name_ids))
+                else:
+                    self.hooks[node_type].append(hook)
+        self.hooks = dict(self.hooks)
+        self.skip_types = common.LEAF_NODE_TYPES - self.hooks.keys()
+        self.stmts_only = not self.name_hook_targets and all(
+            issubclass(node_type, (ast.stmt, ast.Module)) for node_type in self.hooks
+        )
+
+    def get_name_hooks(self, name_id: str) -> typ.List[FixerHook]:
+        name_hooks = self.name_hooks.get(name_id)
+        if name_hooks is None:
+            name_hooks = [
+                hook
+                for hook, name_ids in self.name_hook_targets
+                if name_ids is None or name_id in name_ids
+            ]
+            self.name_hooks[name_id] = name_hooks
+        return name_hooks
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         try:
-            return self.visit(tree)
+            return self.apply_hooks(tree)
         except common.FixerError as ex:
             if ex.module is None:
                 ex.module = tree
             raise
 
+    def apply_hooks(self, tree: ast.Module) -> ast.Module:
+        hooks = self.hooks
+        skip_types = self.skip_types
+        AST = ast.AST
+        Name = ast.Name
+        has_name_hooks = bool(self.name_hook_targets)
+        name_hooks = self.name_hooks
+        stmts_only = self.stmts_only
+        reversed_stmt_list_fields = tuple(reversed(common.STMT_LIST_FIELDS))
+
+        # Entries are (node, parent, field_name, index), where
+        # index is -1 unless the node is an element of a list
+        # field. This is where a replacement node is written to.
+        stack: typ.List[typ.Tuple[ast.AST, typ.Any, str, int]] = [(tree, None, "", -1)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, parent, parent_field_name, index = pop()
+
+            node_type = type(node)
+            if node_type is Name:
+                if has_name_hooks:
+                    node_id = node.id   # type: ignore
+                    node_hooks = name_hooks.get(node_id)
+                    if node_hooks is None:
+                        node_hooks = self.get_name_hooks(node_id)
+                else:
+                    node_hooks = None
+            else:
+                node_hooks = hooks.get(node_type)
+
+            if node_hooks:
+                new_node = node
+                for hook in node_hooks:
+                    new_node = hook(new_node)
+                    if type(new_node) is not node_type:
+                        if not isinstance(new_node, AST):
+                            fixer_name = type(hook.__self__).__name__   # type: ignore
+                            msg = f"{fixer_name} returned {type(new_node).__name__}, expected a node"
+                            raise common.FixerError(msg, node)
+                        break
+
+                if new_node is not node:
+                    if parent is None:
+                        tree = typ.cast(ast.Module, new_node)
+                    elif index < 0:
+                        setattr(parent, parent_field_name, new_node)
+                    else:
+                        getattr(parent, parent_field_name)[index] = new_node
+                    node = new_node
+
+            # NOTE: Children are pushed in reverse, so that they
+            #   are popped in order.
+            if stmts_only:
+                field_names: typ.Iterable[str] = reversed_stmt_list_fields
+            else:
+                field_names = reversed(node._fields)
+
+            for field_name in field_names:
+                field = getattr(node, field_name, None)
+                if isinstance(field, list):
+                    for i in range(len(field) - 1, -1, -1):
+                        item = field[i]
+                        if isinstance(item, AST) and type(item) not in skip_types:
+                            push((item, node, field_name, i))
+                elif isinstance(field, AST) and type(field) not in skip_types:
+                    push((field, node, field_name, -1))
+
+        return tree
+
 
 # NOTE (mb 2018-06-24): Version info pulled from:
 # https://docs.python.org/3/library/__future__.html
@@ -93,15 +372,25 @@ class TransformerFixerBase(FixerBase, ast.NodeTransformer):
 
 class FutureImportFixerBase(FixerBase):
 
+    __slots__ = ()
+
     future_name: str
 
+    _import_decl: typ.ClassVar[common.ImportDecl]
+
+    def __init_subclass__(cls, **kwargs: typ.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._import_decl = common.ImportDecl("__future__", sys.intern(cls.future_name))
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
-        self.required_imports.add(common.ImportDecl("__future__", self.future_name))
+        self.required_imports.add(self._import_decl)
         return tree
 
 
 class AnnotationsFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="3.7",
         apply_until="3.9",
@@ -112,6 +401,8 @@ class AnnotationsFutureFixer(FutureImportFixerBase):
 
 class GeneratorStopFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="3.5",
         apply_until="3.6",
@@ -122,6 +413,8 @@ class GeneratorStopFutureFixer(FutureImportFixerBase):
 
 class UnicodeLiteralsFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.6",
         apply_until="2.7",
@@ -132,6 +425,8 @@ class UnicodeLiteralsFutureFixer(FutureImportFixerBase):
 
 class PrintFunctionFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.6",
         apply_until="2.7",
@@ -142,6 +437,8 @@ class PrintFunctionFutureFixer(FutureImportFixerBase):
 
 class WithStatementFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.5",
         apply_until="2.5",
@@ -152,6 +449,8 @@ class WithStatementFutureFixer(FutureImportFixerBase):
 
 class AbsoluteImportFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.5",
         apply_until="2.7",
@@ -162,6 +461,8 @@ class AbsoluteImportFutureFixer(FutureImportFixerBase):
 
 class DivisionFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.2",
         apply_until="2.7",
@@ -172,6 +473,8 @@ class DivisionFutureFixer(FutureImportFixerBase):
 
 class GeneratorsFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.2",
         apply_until="2.2",
@@ -182,6 +485,8 @@ class GeneratorsFutureFixer(FutureImportFixerBase):
 
 class NestedScopesFutureFixer(FutureImportFixerBase):
 
+    __slots__ = ()
+
     version_info = VersionInfo(
         apply_since="2.1",
         apply_until="2.1",
@@ -190,22 +495,26 @@ class NestedScopesFutureFixer(FutureImportFixerBase):
     future_name = "nested_scopes"
 
 
-class BuiltinsRenameFixerBase(FixerBase):
+class BuiltinsRenameFixerBase(TransformerFixerBase):
 
     old_name: str
     new_name: str
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
-        for node in ast.walk(tree):
-            if not (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)):
-                continue
+    module_declaration: typ.ClassVar[str]
 
-            if node.id == self.new_name:
-                self.module_declarations.add(f"""
-                {self.new_name} = getattr(__builtins__, '{self.old_name}', {self.new_name})
-                """.strip())
+    def __init_subclass__(cls, **kwargs: typ.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.name_ids = frozenset({cls.new_name})
+        cls.trigger_tokens = (cls.new_name,)
+        cls.module_declaration = sys.intern(
+            f"{cls.new_name} = getattr(__builtins__, '{cls.old_name}', {cls.new_name})"
+        )
 
-        return tree
+    def visit_Name(self, node: ast.Name) -> ast.Name:
+        if type(node.ctx) is ast.Load and node.id == self.new_name:
+            self.module_declarations.add(self.module_declaration)
+
+        return node
 
 
 class XrangeToRangeFixer(BuiltinsRenameFixerBase):
@@ -213,7 +522,6 @@ class XrangeToRangeFixer(BuiltinsRenameFixerBase):
     version_info = VersionInfo(
         apply_since="1.0",
         apply_until="2.7",
-        works_until="3.7",
     )
 
     old_name = "xrange"
@@ -225,7 +533,6 @@ class UnicodeToStrFixer(BuiltinsRenameFixerBase):
     version_info = VersionInfo(
         apply_since="1.0",
         apply_until="2.7",
-        works_until="3.7",
     )
 
     old_name = "unicode"
@@ -237,7 +544,6 @@ class UnichrToChrFixer(BuiltinsRenameFixerBase):
     version_info = VersionInfo(
         apply_since="1.0",
         apply_until="2.7",
-        works_until="3.7",
     )
 
     old_name = "unichr"
@@ -249,34 +555,44 @@ class RawInputToInputFixer(BuiltinsRenameFixerBase):
     version_info = VersionInfo(
         apply_since="1.0",
         apply_until="2.7",
-        works_until="3.7",
     )
 
     old_name = "raw_input"
     new_name = "input"
 
 
-class RemoveFunctionDefAnnotationsFixer(FixerBase):
+class RemoveFunctionDefAnnotationsFixer(TransformerFixerBase):
 
     version_info = VersionInfo(
         apply_since="1.0",
         apply_until="2.7",
     )
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                node.returns = None
-                for arg in node.args.args:
-                    arg.annotation = None
-                for arg in node.args.kwonlyargs:
-                    arg.annotation = None
-                if node.args.vararg:
-                    node.args.vararg.annotation = None
-                if node.args.kwarg:
-                    node.args.kwarg.annotation = None
+    def has_fix_targets(self, tree: ast.Module) -> bool:
+        for node in common.get_nodes_by_type(tree).get(ast.FunctionDef, []):
+            assert isinstance(node, ast.FunctionDef)
+            if node.returns is not None:
+                return True
+            args = node.args
+            if any(arg.annotation is not None for arg in args.args + args.kwonlyargs):
+                return True
+            if args.vararg and args.vararg.annotation is not None:
+                return True
+            if args.kwarg and args.kwarg.annotation is not None:
+                return True
+        return False
 
-        return tree
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
+        node.returns = None
+        for arg in node.args.args:
+            arg.annotation = None
+        for arg in node.args.kwonlyargs:
+            arg.annotation = None
+        if node.args.vararg:
+            node.args.vararg.annotation = None
+        if node.args.kwarg:
+            node.args.kwarg.annotation = None
+        return node
 
 
 class RemoveAnnAssignFixer(TransformerFixerBase):
@@ -286,6 +602,11 @@ class RemoveAnnAssignFixer(TransformerFixerBase):
         apply_until="3.5",
     )
 
+    trigger_tokens = (":",)
+
+    def has_fix_targets(self, tree: ast.Module) -> bool:
+        return ast.AnnAssign in common.get_nodes_by_type(tree)
+
     def visit_AnnAssign(self, node: ast.AnnAssign) -> ast.Assign:
         tgt_node = node.target
         if not isinstance(tgt_node, (ast.Name, ast.Attribute)):
@@ -306,34 +627,51 @@ class ShortToLongFormSuperFixer(TransformerFixerBase):
         apply_until="2.7",
     )
 
-    def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
-        for maybe_method in ast.walk(node):
-            if not isinstance(maybe_method, ast.FunctionDef):
-                continue
+    trigger_tokens = ("super",)
 
-            method: ast.FunctionDef = maybe_method
-            method_args: ast.arguments = method.args
-            if len(method_args.args) == 0:
-                continue
-
-            self_arg: ast.arg = method_args.args[0]
+    def _iter_super_calls(
+        self, node: ast.ClassDef
+    ) -> typ.Iterable[typ.Tuple[ast.Call, str]]:
+        """Find super() calls without arguments in the methods of a class.
 
-            for maybe_super_call in ast.walk(method):
-                if not isinstance(maybe_super_call, ast.Call):
-                    continue
+        Yields each call together with the name of the first argument
+        of the (outermost) method which contains it. Nested classes are
+        skipped, they are fixed when their own ClassDef is visited.
+        """
+        # Entries are (node, self_arg_name), where self_arg_name is
+        # None until a method with at least one argument is entered.
+        stack: typ.List[typ.Tuple[ast.AST, typ.Optional[str]]] = [
+            (child_node, None) for child_node in reversed(node.body)
+        ]
+        while stack:
+            sub_node, self_arg_name = stack.pop()
+            sub_node_type = type(sub_node)
+            if sub_node_type is ast.ClassDef or sub_node_type in LEAF_NODE_TYPES:
+                continue
 
-                func_node = maybe_super_call.func
-                if not (isinstance(func_node, ast.Name) and func_node.id == "super"):
-                    continue
+            if self_arg_name is None and isinstance(sub_node, ast.FunctionDef):
+                method_args = sub_node.args.args
+                if method_args:
+                    self_arg_name = method_args[0].arg
+            elif self_arg_name is not None and isinstance(sub_node, ast.Call):
+                func_node = sub_node.func
+                is_short_form_super = (
+                    type(func_node) is ast.Name and
+                    func_node.id == "super" and
+                    len(sub_node.args) == 0
+                )
+                if is_short_form_super:
+                    yield sub_node, self_arg_name
 
-                super_call = maybe_super_call
-                if len(super_call.args) > 0:
-                    continue
+            child_nodes = list(ast.iter_child_nodes(sub_node))
+            stack.extend((child_node, self_arg_name) for child_node in reversed(child_nodes))
 
-                super_call.args = [
-                    ast.Name(id=node.name, ctx=ast.Load()),
-                    ast.Name(id=self_arg.arg, ctx=ast.Load()),
-                ]
+    def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
+        for super_call, self_arg_name in self._iter_super_calls(node):
+            super_call.args = [
+                ast.Name(id=node.name, ctx=_LOAD),
+                ast.Name(id=self_arg_name, ctx=_LOAD),
+            ]
         return node
 
 
@@ -344,6 +682,14 @@ class InlineKWOnlyArgsFixer(TransformerFixerBase):
         apply_until="3.5",
     )
 
+    trigger_tokens = ("*",)
+
+    def has_fix_targets(self, tree: ast.Module) -> bool:
+        for node in common.get_nodes_by_type(tree).get(ast.FunctionDef, []):
+            if isinstance(node, ast.FunctionDef) and node.args.kwonlyargs:
+                return True
+        return False
+
     def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
         if not node.args.kwonlyargs:
             return node
@@ -358,21 +704,20 @@ class InlineKWOnlyArgsFixer(TransformerFixerBase):
         #   if they are literals. Everything else would
         #   change the semantics too much and so we should
         #   raise an error.
-        kwonlyargs = reversed(node.args.kwonlyargs)
-        kw_defaults = reversed(node.args.kw_defaults)
-        for arg, default in zip(kwonlyargs, kw_defaults):
+        prologue: typ.List[ast.stmt] = []
+        for arg, default in zip(node.args.kwonlyargs, node.args.kw_defaults):
             arg_name = arg.arg
             if default is None:
                 new_node = ast.Assign(
-                    targets=[ast.Name(id=arg_name, ctx=ast.Store())],
+                    targets=[ast.Name(id=arg_name, ctx=_STORE)],
                     value=ast.Subscript(
-                        value=ast.Name(id=kw_name, ctx=ast.Load()),
+                        value=ast.Name(id=kw_name, ctx=_LOAD),
                         slice=ast.Index(value=ast.Str(s=arg_name)),
-                        ctx=ast.Load(),
+                        ctx=_LOAD,
                     )
                 )
             else:
-                if not isinstance(default, ImmutableValueNodes):
+                if type(default) not in IMMUTABLE_VALUE_NODE_TYPES:
                     msg = (
                         f"Keyword only arguments must be immutable. "
                         f"Found: {default} for {arg_name}"
@@ -382,21 +727,22 @@ class InlineKWOnlyArgsFixer(TransformerFixerBase):
                 new_node = ast.Assign(
                     targets=[ast.Name(
                         id=arg_name,
-                        ctx=ast.Store(),
+                        ctx=_STORE,
                     )],
                     value=ast.Call(
                         func=ast.Attribute(
-                            value=ast.Name(id=kw_name, ctx=ast.Load()),
+                            value=ast.Name(id=kw_name, ctx=_LOAD),
                             attr="get",
-                            ctx=ast.Load(),
+                            ctx=_LOAD,
                         ),
                         args=[ast.Str(s=arg_name), default],
                         keywords=[],
                     )
                 )
 
-            node.body.insert(0, new_node)
+            prologue.append(new_node)
 
+        node.body[0:0] = prologue
         node.args.kwonlyargs = []
 
         return node
@@ -411,47 +757,54 @@ if sys.version_info >= (3, 6):
             apply_until="3.5",
         )
 
-        def _formatted_value_str(
+        # NOTE: With rf"..." and fr"..." one of these occurs too.
+        trigger_tokens = ("f'", 'f"', "F'", 'F"', "r'", 'r"', "R'", 'R"')
+
+        def has_fix_targets(self, tree: ast.Module) -> bool:
+            return ast.JoinedStr in common.get_nodes_by_type(tree)
+
+        def _append_formatted_value(
             self,
             fmt_val_node: ast.FormattedValue,
             arg_nodes: typ.List[ast.expr],
-        ) -> str:
+            fmt_parts: typ.List[str],
+        ) -> None:
             arg_index = len(arg_nodes)
             arg_nodes.append(fmt_val_node.value)
 
             format_spec_node = fmt_val_node.format_spec
-            if format_spec_node is None:
-                format_spec = ""
-            elif not isinstance(format_spec_node, ast.JoinedStr):
-                raise common.FixerError("Unexpected Node Type", format_spec_node)
-            else:
-                format_spec = ":" + self._joined_str_str(format_spec_node, arg_nodes)
-
-            return "{" + str(arg_index) + format_spec + "}"
-
-        def _joined_str_str(
+            fmt_parts.append("{" + str(arg_index))
+            if format_spec_node is not None:
+                if not isinstance(format_spec_node, ast.JoinedStr):
+                    raise common.FixerError("Unexpected Node Type", format_spec_node)
+                fmt_parts.append(":")
+                self._append_joined_str(format_spec_node, arg_nodes, fmt_parts)
+            fmt_parts.append("}")
+
+        def _append_joined_str(
             self,
             joined_str_node: ast.JoinedStr,
             arg_nodes: typ.List[ast.expr],
-        ) -> str:
-            fmt_str = ""
+            fmt_parts: typ.List[str],
+        ) -> None:
             for val in joined_str_node.values:
                 if isinstance(val, ast.Str):
-                    fmt_str += val.s
+                    fmt_parts.append(val.s)
                 elif isinstance(val, ast.FormattedValue):
-                    fmt_str += self._formatted_value_str(val, arg_nodes)
+                    self._append_formatted_value(val, arg_nodes, fmt_parts)
                 else:
                     raise common.FixerError("Unexpected Node Type", val)
-            return fmt_str
 
         def visit_JoinedStr(self, node: ast.JoinedStr) -> ast.Call:
             arg_nodes: typ.List[ast.expr] = []
+            fmt_parts: typ.List[str] = []
 
-            fmt_str = self._joined_str_str(node, arg_nodes)
+            self._append_joined_str(node, arg_nodes, fmt_parts)
+            fmt_str = "".join(fmt_parts)
             format_attr_node = ast.Attribute(
                 value=ast.Str(s=fmt_str),
                 attr="format",
-                ctx=ast.Load(),
+                ctx=_LOAD,
             )
             return ast.Call(func=format_attr_node, args=arg_nodes, keywords=[])
 
@@ -463,9 +816,11 @@ class NewStyleClassesFixer(TransformerFixerBase):
         apply_until="2.7",
     )
 
+    trigger_tokens = ("class",)
+
     def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
         if len(node.bases) == 0:
-            node.bases.append(ast.Name(id="object", ctx=ast.Load()))
+            node.bases.append(ast.Name(id="object", ctx=_LOAD))
         return node
 
 
@@ -474,40 +829,49 @@ class ItertoolsBuiltinsFixer(TransformerFixerBase):
     version_info = VersionInfo(
         apply_since="2.3",      # introduction of the itertools module
         apply_until="2.7",
-        works_until="3.7",
     )
 
+    trigger_tokens = ("map", "zip", "filter")
+
     # WARNING (mb 2018-06-09): This fix is very broad, and should
     #   only be used in combination with a sanity check that the
     #   builtin names are not being overridden.
 
-    def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
-        return self.visit(tree)
+    name_ids = frozenset({"map", "zip", "filter"})
+
+    module_declarations_by_name: typ.ClassVar[typ.Dict[str, str]] = {
+        name: sys.intern(f"{name} = getattr(itertools, 'i{name}', {name})")
+        for name in name_ids
+    }
 
     def visit_Name(self, node: ast.Name) -> typ.Union[ast.Name, ast.Attribute]:
-        if isinstance(node.ctx, ast.Load) and node.id in ("map", "zip", "filter"):
-            self.required_imports.add(common.ImportDecl("itertools", None))
-            global_decl = f"{node.id} = getattr(itertools, 'i{node.id}', {node.id})"
-            self.module_declarations.add(global_decl)
+        if type(node.ctx) is ast.Load and node.id in self.name_ids:
+            self.required_imports.add(_IMPORT_ITERTOOLS)
+            self.module_declarations.add(self.module_declarations_by_name[node.id])
 
         return node
 
 
-def is_dict_call(node: ast.expr) -> bool:
-    return (
-        isinstance(node, ast.Call) and
-        isinstance(node.func, ast.Name) and
-        node.func.id == "dict"
-    )
-
-
 class UnpackingGeneralizationsFixer(FixerBase):
 
+    __slots__ = ("_relevant_ids",)
+
     version_info = VersionInfo(
         apply_since="2.0",
         apply_until="3.4",
     )
 
+    trigger_tokens = ("*",)
+
+    # Ids of the nodes which need to be fixed and of their
+    # ancestors. Other nodes are not walked. If None, all nodes
+    # are walked.
+    _relevant_ids: typ.Optional[typ.Set[int]]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._relevant_ids = None
+
     def _has_stararg_g12n(self, node: ast.expr) -> bool:
         if isinstance(node, ast.Call):
             elts = node.args
@@ -516,31 +880,17 @@ class UnpackingGeneralizationsFixer(FixerBase):
         else:
             raise TypeError(f"Unexpected node: {node}")
 
-        has_starred_arg = False
-        for arg in elts:
-            # Anything after * means we have to apply the fix
-            if has_starred_arg:
-                return True
-            has_starred_arg = isinstance(arg, ast.Starred)
-        return False
+        # Anything after * means we have to apply the fix, so a
+        # starred arg in the last position can be ignored.
+        return any(type(arg) is ast.Starred for arg in elts[:-1])
 
     def _has_starstarargs_g12n(self, node: ast.expr) -> bool:
+        # Anything after ** means we have to apply the fix, so a
+        # starstarred arg in the last position can be ignored.
         if isinstance(node, ast.Call):
-            has_kwstarred_arg = False
-            for kw in node.keywords:
-                if has_kwstarred_arg:
-                    # Anything after ** means we have to apply the fix
-                    return True
-                has_kwstarred_arg = kw.arg is None
-            return False
+            return any(kw.arg is None for kw in node.keywords[:-1])
         elif isinstance(node, ast.Dict):
-            has_kwstarred_arg = False
-            for key in node.keys:
-                if has_kwstarred_arg:
-                    # Anything after ** means we have to apply the fix
-                    return True
-                has_kwstarred_arg = key is None
-            return False
+            return any(key is None for key in node.keys[:-1])
         else:
             raise TypeError(f"Unexpected node: {node}")
 
@@ -559,20 +909,20 @@ class UnpackingGeneralizationsFixer(FixerBase):
 
     def _node_with_binop(self, node: ast.AST, binop: ast.BinOp) -> ast.expr:
         if isinstance(node, ast.Call):
-            node.args = [ast.Starred(value=binop, ctx=ast.Load())]
+            node.args = [ast.Starred(value=binop, ctx=_LOAD)]
             return node
         elif isinstance(node, ast.List):
             # NOTE (mb 2018-06-29): Operands of the binop are always lists
             return binop
         elif isinstance(node, ast.Set):
             return ast.Call(
-                func=ast.Name(id="set", ctx=ast.Load()),
+                func=ast.Name(id="set", ctx=_LOAD),
                 args=[binop],
                 keywords=[],
             )
         elif isinstance(node, ast.Tuple):
             return ast.Call(
-                func=ast.Name(id="tuple", ctx=ast.Load()),
+                func=ast.Name(id="tuple", ctx=_LOAD),
                 args=[binop],
                 keywords=[],
             )
@@ -596,13 +946,12 @@ class UnpackingGeneralizationsFixer(FixerBase):
         else:
             raise TypeError(f"Unexpected node: {node}")
 
-        operands: typ.List[ast.expr] = [ast.List(elts=[])]
+        # NOTE: tail_elts are the elts of the last operand, which is
+        #   always a list node until the end of the loop.
+        tail_elts: typ.List[ast.expr] = []
+        operands: typ.List[ast.expr] = [ast.List(elts=tail_elts)]
 
         for elt in elts:
-            tail_list = operands[-1]
-            assert isinstance(tail_list, ast.List)
-            tail_elts = tail_list.elts
-
             if not isinstance(elt, ast.Starred):
                 # NOTE (mb 2018-07-06): Simple case, just a new
                 #   element for right leaf: fn(*x, *[1, 2], >z<)
@@ -621,7 +970,7 @@ class UnpackingGeneralizationsFixer(FixerBase):
             #   call list(x) and add it in the binop tree
             # elements for right leaf: fn(*>x<, *[1, 2], z)
             new_val_node = ast.Call(
-                func=ast.Name(id="list", ctx=ast.Load()),
+                func=ast.Name(id="list", ctx=_LOAD),
                 args=[val],
                 keywords=[],
             )
@@ -630,12 +979,11 @@ class UnpackingGeneralizationsFixer(FixerBase):
             else:
                 operands.append(new_val_node)
 
-            operands.append(ast.List(elts=[]))
+            tail_elts = []
+            operands.append(ast.List(elts=tail_elts))
 
-        tail_list = operands[-1]
-        assert isinstance(tail_list, ast.List)
-        if len(tail_list.elts) == 0:
-            operands = operands[:-1]
+        if len(tail_elts) == 0:
+            operands.pop()
 
         if len(operands) == 1:
             tail_list = operands[0]
@@ -645,13 +993,13 @@ class UnpackingGeneralizationsFixer(FixerBase):
         if len(operands) > 1:
             binop = ast.BinOp(
                 left=operands[0],
-                op=ast.Add(),
+                op=_ADD,
                 right=operands[1],
             )
             for operand in operands[2:]:
                 binop = ast.BinOp(
                     left=binop,
-                    op=ast.Add(),
+                    op=_ADD,
                     right=operand,
                 )
             return self._node_with_binop(node, binop)
@@ -717,10 +1065,9 @@ class UnpackingGeneralizationsFixer(FixerBase):
                 collapsed_chain_values.append(chain_val)
             else:
                 prev_chain_val = collapsed_chain_values[-1]
-                if isinstance(chain_val, ast.Dict) and isinstance(prev_chain_val, ast.Dict):
-                    for key, val in zip(chain_val.keys, chain_val.values):
-                        prev_chain_val.keys.append(key)
-                        prev_chain_val.values.append(val)
+                if type(chain_val) is ast.Dict and type(prev_chain_val) is ast.Dict:
+                    prev_chain_val.keys.extend(chain_val.keys)
+                    prev_chain_val.values.extend(chain_val.values)
                 else:
                     collapsed_chain_values.append(chain_val)
 
@@ -750,19 +1097,19 @@ class UnpackingGeneralizationsFixer(FixerBase):
                 raise TypeError(f"Unexpected node type {node}")
         else:
             assert isinstance(node, ast.Call)
-            self.required_imports.add(common.ImportDecl("itertools", None))
+            self.required_imports.add(_IMPORT_ITERTOOLS)
             chain_args = []
             for val in chain_values:
-                items_func = ast.Attribute(value=val, attr='items', ctx=ast.Load())
+                items_func = ast.Attribute(value=val, attr='items', ctx=_LOAD)
                 chain_args.append(ast.Call(func=items_func, args=[], keywords=[]))
 
             value_node = ast.Call(
-                func=ast.Name(id='dict', ctx=ast.Load()),
+                func=ast.Name(id='dict', ctx=_LOAD),
                 args=[ast.Call(
                     func=ast.Attribute(
-                        value=ast.Name(id='itertools', ctx=ast.Load()),
+                        value=ast.Name(id='itertools', ctx=_LOAD),
                         attr='chain',
-                        ctx=ast.Load(),
+                        ctx=_LOAD,
                     ),
                     args=chain_args,
                     keywords=[],
@@ -778,122 +1125,186 @@ class UnpackingGeneralizationsFixer(FixerBase):
 
     def visit_expr(self, node: ast.expr, parent: ast.AST, field_name: str) -> ast.expr:
         new_node = node
-        if isinstance(node, ArgUnpackNodes) and self._has_stararg_g12n(node):
+        if type(node) in ARG_UNPACK_NODE_TYPES and self._has_stararg_g12n(node):
             new_node = self.expand_stararg_g12n(new_node, parent, field_name)
-        if isinstance(node, KwArgUnpackNodes) and self._has_starstarargs_g12n(node):
+        if type(node) in KWARG_UNPACK_NODE_TYPES and self._has_starstarargs_g12n(node):
             new_node = self.expand_starstararg_g12n(new_node, parent, field_name)
         return new_node
 
-    def is_stmtlist(self, nodelist: typ.Any):
-        return isinstance(nodelist, list) and all(isinstance(n, ast.stmt) for n in nodelist)
+    def _is_redundant_dict_splat(self, node: ast.AST) -> bool:
+        """Check for dict(**x) where x is a dict display or dict call."""
+        # NOTE: This is called for every node of a module, so the
+        #   dict call checks are inlined.
+        if not (
+            type(node) is ast.Call and
+            type(node.func) is ast.Name and
+            node.func.id == "dict" and
+            len(node.args) == 0 and
+            len(node.keywords) == 1 and
+            node.keywords[0].arg is None
+        ):
+            return False
+
+        splat_value = node.keywords[0].value
+        if type(splat_value) is ast.Dict:
+            return True
+        return (
+            type(splat_value) is ast.Call and
+            type(splat_value.func) is ast.Name and
+            splat_value.func.id == "dict"
+        )
+
+    def _needs_fix(self, node: ast.AST) -> bool:
+        node_type = type(node)
+        if node_type in ARG_UNPACK_NODE_TYPES:
+            assert isinstance(node, ast.expr)
+            if self._has_stararg_g12n(node):
+                return True
+        if node_type in KWARG_UNPACK_NODE_TYPES:
+            assert isinstance(node, ast.expr)
+            if self._has_starstarargs_g12n(node):
+                return True
+        return self._is_redundant_dict_splat(node)
+
+    def _fix_expr(self, node: ast.expr, parent: ast.AST, field_name: str) -> ast.expr:
+        new_expr_node = self.visit_expr(node, parent, field_name)
+
+        if self._is_redundant_dict_splat(new_expr_node):
+            assert isinstance(new_expr_node, ast.Call)
+            return new_expr_node.keywords[0].value
+
+        return new_expr_node
+
+    def _find_relevant_ids(self, tree: ast.Module) -> typ.Set[int]:
+        # NOTE: Most modules don't have any unpacking
+        #   generalizations, so the cheap check comes first and
+        #   the parents of nodes are only looked up if needed.
+        fix_sites = [node for node in common.iter_nodes(tree) if self._needs_fix(node)]
+        if not fix_sites:
+            return set()
+
+        parents: typ.Dict[int, ast.AST] = {}
+        for node in common.iter_nodes(tree):
+            for child_node in ast.iter_child_nodes(node):
+                parents[id(child_node)] = node
+
+        relevant_ids: typ.Set[int] = set()
+        for node in fix_sites:
+            node_id = id(node)
+            while node_id not in relevant_ids:
+                relevant_ids.add(node_id)
+                parent = parents.get(node_id)
+                if parent is None:
+                    break
+                node_id = id(parent)
+        return relevant_ids
 
     def walk_stmtlist(
         self, stmtlist: typ.List[ast.stmt], parent: ast.AST, field_name: str
     ) -> typ.List[ast.stmt]:
-        assert self.is_stmtlist(stmtlist)
-
-        new_stmts: typ.List[ast.stmt] = []
-        for stmt in stmtlist:
-            new_stmt = self.walk_stmt(stmt, parent, field_name)
-            new_stmts.append(new_stmt)
-        return new_stmts
+        return [self.walk_stmt(stmt, parent, field_name) for stmt in stmtlist]
 
     def walk_expr(self, node: ast.expr, parent: ast.AST, parent_field_name: str) -> ast.expr:
         new_node_expr = self.walk_node(node, parent, parent_field_name)
         assert isinstance(new_node_expr, ast.expr)
         return new_node_expr
 
-    def iter_walkable_fields(self, node: ast.AST) -> typ.Iterable[typ.Any]:
-        for field_name, field_node in ast.iter_fields(node):
-            if isinstance(field_node, ast.arguments):
-                continue
-            if isinstance(field_node, ast.expr_context):
-                continue
-            if isinstance(field_node, LeafNodes):
+    def iter_walkable_fields(self, node: ast.AST) -> typ.Iterable[typ.Tuple[str, typ.Any, bool]]:
+        node_type = type(node)
+        for field_name in walkable_field_names(node_type):
+            field_node = getattr(node, field_name, None)
+            if field_node is None:
                 continue
 
-            yield field_name, field_node
+            field_key = (node_type, field_name)
+            is_list_field = _LIST_FIELDS_CACHE.get(field_key)
+            if is_list_field is None:
+                is_list_field = isinstance(field_node, list)
+                _LIST_FIELDS_CACHE[field_key] = is_list_field
 
-    def walk_node(self, node: ast.AST, parent: ast.AST, parent_field_name: str) -> ast.AST:
-        if isinstance(node, LeafNodes):
-            return node
+            if not is_list_field:
+                field_node_type = type(field_node)
+                if field_node_type is ast.arguments or field_node_type in LEAF_NODE_TYPES:
+                    continue
 
-        # print("-->", parent_field_name.ljust(15), node)
-
-        for field_name, field_node in self.iter_walkable_fields(node):
-            if isinstance(field_node, ast.AST):
-                new_node = self.walk_node(field_node, node, field_name)
-                setattr(node, field_name, new_node)
-            elif isinstance(field_node, list):
-                new_field_node = []
-                new_sub_node: ast.AST
-                for sub_node in field_node:
-                    if isinstance(sub_node, LeafNodes):
-                        new_sub_node = sub_node
-                    elif isinstance(sub_node, ast.AST):
-                        new_sub_node = self.walk_node(sub_node, node, field_name)
-                    else:
-                        new_sub_node = sub_node
-                    new_field_node.append(new_sub_node)
+            yield field_name, field_node, is_list_field
 
-                setattr(node, field_name, new_field_node)
+    def walk_node(self, node: ast.AST, parent: ast.AST, parent_field_name: str) -> ast.AST:
+        """Fix node and all of its descendants.
 
-        if not isinstance(node, ast.expr):
+        Children are fixed before their parent (post-order). Rather
+        than recursing, an explicit stack is used, so that deeply
+        nested expressions don't run into the recursion limit.
+        """
+        relevant_ids = self._relevant_ids
+        if type(node) in LEAF_NODE_TYPES:
+            return node
+        if relevant_ids is not None and id(node) not in relevant_ids:
             return node
 
-        new_expr_node = self.visit_expr(node, parent, parent_field_name)
-
-        if isinstance(new_expr_node, ast.Call):
-            is_single_dict_splat = (
-                is_dict_call(new_expr_node) and
-                len(new_expr_node.args) == 0 and
-                len(new_expr_node.keywords) == 1 and
-                new_expr_node.keywords[0].arg is None
-            )
-            if is_single_dict_splat:
-                keyword_node = new_expr_node.keywords[0]
-                if is_dict_call(keyword_node.value) or isinstance(keyword_node.value, ast.Dict):
-                    return keyword_node.value
+        root_node = node
+        new_root_node = node
+
+        # Entries are (node, parent, field_name, index, is_expanded),
+        # where index is -1 unless the node is an element of a list
+        # field and is_expanded is True once the children of the
+        # node have been pushed.
+        stack: typ.List[typ.Tuple[ast.AST, ast.AST, str, int, bool]] = [
+            (node, parent, parent_field_name, -1, False)
+        ]
+        while stack:
+            node, parent, field_name, index, is_expanded = stack.pop()
+
+            if not is_expanded:
+                stack.append((node, parent, field_name, index, True))
+                children: typ.List[typ.Tuple[ast.AST, ast.AST, str, int, bool]] = []
+                for child_field_name, field_node, is_list_field in self.iter_walkable_fields(node):
+                    if is_list_field:
+                        children.extend([
+                            (sub_node, node, child_field_name, i, False)
+                            for i, sub_node in enumerate(field_node)
+                            if (
+                                isinstance(sub_node, ast.AST) and
+                                type(sub_node) not in LEAF_NODE_TYPES and
+                                (relevant_ids is None or id(sub_node) in relevant_ids)
+                            )
+                        ])
+                    elif isinstance(field_node, ast.AST):
+                        if relevant_ids is None or id(field_node) in relevant_ids:
+                            children.append((field_node, node, child_field_name, -1, False))
+                # NOTE: Children are pushed in reverse, so that they
+                #   are fixed in order.
+                stack.extend(reversed(children))
+                continue
 
-        return new_expr_node
+            if not isinstance(node, ast.expr):
+                continue
 
-    def walk_stmt(self, node: ast.stmt, parent: ast.AST, field_name: str) -> ast.stmt:
-        assert not self.is_stmtlist(node)
-        # print("==>", field_name.ljust(15), node)
-
-        for field_name, field_node in self.iter_walkable_fields(node):
-            if self.is_stmtlist(field_node):
-                old_field_nodelist = field_node
-                new_field_nodelist = self.walk_stmtlist(
-                    old_field_nodelist, parent=node, field_name=field_name
-                )
-                setattr(node, field_name, new_field_nodelist)
-            elif isinstance(field_node, ast.stmt):
-                new_stmt = self.walk_stmt(field_node, node, field_name)
-                setattr(node, field_name, new_stmt)
-            elif isinstance(field_node, ast.AST):
-                new_node = self.walk_node(field_node, node, field_name)
-                setattr(node, field_name, new_node)
-            elif isinstance(field_node, list):
-                new_field_node = []
-                new_sub_node: ast.AST
-                for sub_node in field_node:
-                    if isinstance(sub_node, LeafNodes):
-                        new_sub_node = sub_node
-                    elif isinstance(sub_node, ast.AST):
-                        new_sub_node = self.walk_node(sub_node, node, field_name)
-                    else:
-                        new_sub_node = sub_node
-                    new_field_node.append(new_sub_node)
+            new_node = self._fix_expr(node, parent, field_name)
+            if new_node is node:
+                continue
 
-                setattr(node, field_name, new_field_node)
+            if node is root_node:
+                new_root_node = new_node
+            elif index < 0:
+                setattr(parent, field_name, new_node)
             else:
-                continue
+                getattr(parent, field_name)[index] = new_node
 
-        return node
+        return new_root_node
+
+    def walk_stmt(self, node: ast.stmt, parent: ast.AST, field_name: str) -> ast.stmt:
+        new_stmt = self.walk_node(node, parent, field_name)
+        assert isinstance(new_stmt, ast.stmt)
+        return new_stmt
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
-        tree.body = self.walk_stmtlist(tree.body, tree, "body")
+        self._relevant_ids = self._find_relevant_ids(tree)
+        try:
+            if self._relevant_ids:
+                tree.body = self.walk_stmtlist(tree.body, tree, "body")
+        finally:
+            self._relevant_ids = None
         return tree
 
 
@@ -904,6 +1315,8 @@ class NamedTupleClassToAssignFixer(TransformerFixerBase):
         apply_until="3.4",
     )
 
+    trigger_tokens = ("NamedTuple",)
+
     _typing_module_name: typ.Optional[str]
     _namedtuple_class_name: typ.Optional[str]
 
@@ -912,24 +1325,36 @@ class NamedTupleClassToAssignFixer(TransformerFixerBase):
         self._namedtuple_class_name = None
         super().__init__()
 
-    def visit_ImportFrom(self, node: ast.ImportFrom) -> ast.ImportFrom:
-        if node.module == "typing":
-            for alias in node.names:
-                if alias.name == "NamedTuple":
-                    if alias.asname is None:
-                        self._namedtuple_class_name = alias.name
-                    else:
-                        self._namedtuple_class_name = alias.asname
-
-        return node
-
-    def visit_Import(self, node: ast.Import) -> ast.Import:
-        for alias in node.names:
-            if alias.name == "typing":
-                if alias.asname is None:
-                    self._typing_module_name = alias.name
-                else:
-                    self._typing_module_name = alias.asname
+    def reset(self) -> None:
+        self._typing_module_name = None
+        self._namedtuple_class_name = None
+        super().reset()
+
+    def has_fix_targets(self, tree: ast.Module) -> bool:
+        index = common.get_nodes_by_type(tree)
+        return ast.ClassDef in index and (ast.Import in index or ast.ImportFrom in index)
+
+    def visit_Module(self, node: ast.Module) -> ast.Module:
+        # NOTE: The module is visited before any of its statements, so
+        #   the imports are collected here, with a scan which only
+        #   looks at statements, rather than with visit_Import and
+        #   visit_ImportFrom hooks.
+        for stmt in common.iter_stmts(node):
+            if isinstance(stmt, ast.ImportFrom):
+                if stmt.module == "typing":
+                    for alias in stmt.names:
+                        if alias.name == "NamedTuple":
+                            if alias.asname is None:
+                                self._namedtuple_class_name = alias.name
+                            else:
+                                self._namedtuple_class_name = alias.asname
+            elif isinstance(stmt, ast.Import):
+                for alias in stmt.names:
+                    if alias.name == "typing":
+                        if alias.asname is None:
+                            self._typing_module_name = alias.name
+                        else:
+                            self._typing_module_name = alias.asname
         return node
 
     def visit_ClassDef(self, node: ast.ClassDef) -> typ.Union[ast.ClassDef, ast.Assign]:
@@ -950,36 +1375,28 @@ class NamedTupleClassToAssignFixer(TransformerFixerBase):
 
         if self._typing_module_name:
             func = ast.Attribute(
-                value=ast.Name(id=self._typing_module_name, ctx=ast.Load()),
+                value=ast.Name(id=self._typing_module_name, ctx=_LOAD),
                 attr="NamedTuple",
-                ctx=ast.Load(),
+                ctx=_LOAD,
             )
         elif self._namedtuple_class_name:
-            func = ast.Name(id=self._namedtuple_class_name, ctx=ast.Load())
+            func = ast.Name(id=self._namedtuple_class_name, ctx=_LOAD)
         else:
             raise RuntimeError("")
 
-        elts: typ.List[ast.Tuple] = []
-
-        for assign in node.body:
-            if not isinstance(assign, ast.AnnAssign):
-                continue
-            tgt = assign.target
-            if not isinstance(tgt, ast.Name):
-                continue
-
-            elts.append(ast.Tuple(
-                elts=[ast.Str(s=tgt.id), assign.annotation],
-                ctx=ast.Load(),
-            ))
+        elts: typ.List[ast.expr] = [
+            ast.Tuple(elts=[ast.Str(s=assign.target.id), assign.annotation], ctx=_LOAD)
+            for assign in node.body
+            if isinstance(assign, ast.AnnAssign) and isinstance(assign.target, ast.Name)
+        ]
 
         return ast.Assign(
-            targets=[ast.Name(id=node.name, ctx=ast.Store())],
+            targets=[ast.Name(id=node.name, ctx=_STORE)],
             value=ast.Call(
                 func=func,
                 args=[
                     ast.Str(s=node.name),
-                    ast.List(elts=elts, ctx=ast.Load()),
+                    ast.List(elts=elts, ctx=_LOAD),
                 ],
                 keywords=[],
             )
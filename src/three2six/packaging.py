@@ -8,7 +8,6 @@ import sys
 import shutil
 import tempfile
 import typing as typ
-import hashlib as hl
 import pathlib2 as pl
 
 from . import transpile
@@ -42,9 +41,15 @@ def eval_build_config() -> common.BuildConfig:
 
     return {
         "target_version"  : "2.7",
+        # NOTE: The cache is opt-in, set this to "0" to use it.
         "force_transpile" : "1",
         "fixers"          : "",
         "checkers"        : "",
+        "cache_dir"       : str(CACHE_DIR),
+        # NOTE: Transpiling in a process pool is opt-in, as it
+        #   requires a __main__ guard in setup.py on platforms
+        #   where the spawn start method is the default.
+        "max_workers"     : "1",
     }
 
 
@@ -96,6 +101,7 @@ def init_build_package_dir(norm_package_dir: common.PackageDir) -> common.Packag
 
 
 def build_package(cfg: common.BuildConfig, package: str, build_dir: str) -> None:
+    module_sources: typ.Dict[str, bytes] = {}
     for root, dirs, files in os.walk(build_dir):
         for filename in files:
             filepath = pl.Path(root) / filename
@@ -103,17 +109,15 @@ def build_package(cfg: common.BuildConfig, package: str, build_dir: str) -> None
                 continue
 
             with open(filepath, mode="rb") as fh:
-                module_source_data = fh.read()
-
-            filehash = hl.sha1(module_source_data).hexdigest()
-            cache_path = CACHE_DIR / (filehash + ".py")
-
-            if int(cfg["force_transpile"]) or not cache_path.exists():
-                fixed_module_source_data = transpile.transpile_module_data(cfg, module_source_data)
-                with open(cache_path, mode="wb") as fh:
-                    fh.write(fixed_module_source_data)
-
-            shutil.copy(cache_path, filepath)
+                module_sources[str(filepath)] = fh.read()
+
+    # NOTE: Unchanged modules are not transpiled again, the
+    #   output is cached in cfg["cache_dir"].
+    max_workers = int(cfg.get("max_workers", "1"))
+    fixed_module_sources = transpile.transpile_many(cfg, module_sources, max_workers)
+    for filepath_str, fixed_module_source_data in fixed_module_sources.items():
+        with open(filepath_str, mode="wb") as fh:
+            fh.write(fixed_module_source_data)
 
 
 def build_packages(cfg: common.BuildConfig, build_package_dir: common.PackageDir) -> None:
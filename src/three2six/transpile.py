@@ -7,10 +7,13 @@
 import re
 import ast
 import sys
-import astor
 import typing as typ
+import functools
+import collections
+import concurrent.futures as cf
 
 from . import utils
+from . import cache
 from . import common
 from . import fixers
 from . import checkers
@@ -23,12 +26,24 @@ DEFAULT_SOURCE_ENCODING = "utf-8"
 DEFAULT_TARGET_VERSION = "2.7"
 
 # https://www.python.org/dev/peps/pep-0263/
-SOURCE_ENCODING_RE = re.compile(r"""
-    ^
-    [ \t\v]*
-    \#.*?coding[:=][ \t]*
-    (?P<coding>[-_.a-zA-Z0-9]+)
-""", re.VERBOSE)
+SOURCE_ENCODING_PATTERN = r"^[ \t\v]*#.*?coding[:=][ \t]*(?P<coding>[-_.a-zA-Z0-9]+)"
+
+SOURCE_ENCODING_RE = re.compile(SOURCE_ENCODING_PATTERN)
+
+SOURCE_ENCODING_RE_BYTES = re.compile(SOURCE_ENCODING_PATTERN.encode("ascii"))
+
+
+def _iter_lines(source: typ.AnyStr, sep: typ.AnyStr) -> typ.Iterable[typ.AnyStr]:
+    # NOTE: Only the lines up to the end of the header are consumed,
+    #   so the source is split lazily rather than with splitlines.
+    start = 0
+    while start < len(source):
+        end = source.find(sep, start)
+        if end < 0:
+            yield source[start:]
+            return
+        yield source[start:end]
+        start = end + 1
 
 
 def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str, str]:
@@ -38,12 +53,21 @@ def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str,
 
     header_lines: typ.List[str] = []
 
-    # NOTE (mb 2018-06-23): Sneaky replacement of coding is done during
-    #   consumption of the generator.
-    source_lines: typ.Iterable[str] = (
-        line.decode(coding, errors="ignore") if isinstance(line, bytes) else line
-        for line in module_source.splitlines()
-    )
+    source_lines: typ.Iterable[str]
+    if isinstance(module_source, bytes):
+        # NOTE: Per PEP 263, the coding declaration is ascii, so it
+        #   is matched before anything is decoded. Only the lines
+        #   of the header are decoded, using the declared coding.
+        for source_line in module_source.split(b"\n", 2)[:2]:
+            m_bytes = SOURCE_ENCODING_RE_BYTES.match(source_line)
+            if m_bytes:
+                coding = m_bytes.group("coding").decode("ascii").strip()
+                break
+        source_lines = (
+            line.decode(coding, errors="ignore") for line in _iter_lines(module_source, b"\n")
+        )
+    else:
+        source_lines = _iter_lines(module_source, "\n")
 
     for i, line in enumerate(source_lines):
         if i < 2:
@@ -55,7 +79,9 @@ def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str,
                     coding = m.group("coding").strip()
                     coding_declared = True
 
-        if not line.rstrip() or line.rstrip().startswith("#"):
+        line = line.rstrip("\r")
+        stripped_line = line.rstrip()
+        if not stripped_line or stripped_line.startswith("#"):
             header_lines.append(line)
         else:
             break
@@ -78,8 +104,11 @@ FixerType = typ.Type[fixers.FixerBase]
 CheckerOrFixer = typ.Union[CheckerType, FixerType]
 
 
+NORMALIZE_NAME_TABLE = str.maketrans("", "", "_-")
+
+
 def normalize_name(name: str) -> str:
-    name = name.strip().lower().replace("_", "").replace("-", "")
+    name = name.strip().lower().translate(NORMALIZE_NAME_TABLE)
     if name.endswith("fixer"):
         name = name[:-len("fixer")]
     if name.endswith("checker"):
@@ -88,25 +117,11 @@ def normalize_name(name: str) -> str:
 
 
 def get_available_classes(
-    module: object, clazz: CheckerOrFixer
+    classes: typ.Sequence[CheckerOrFixer]
 ) -> typ.Dict[str, CheckerOrFixer]:
-
-    assert isinstance(clazz, type)
-    clazz_name = clazz.__name__
-    assert clazz_name.endswith("Base")
-    assert getattr(module, clazz_name) is clazz
-
-    maybe_classes = {
-        name: getattr(module, name)
-        for name in dir(module)
-        if not name.endswith(clazz_name)
-    }
-
-    return {
-        normalize_name(attr_name): attr
-        for attr_name, attr in maybe_classes.items()
-        if type(attr) == type and issubclass(attr, clazz)
-    }
+    available_classes = {normalize_name(clazz.__name__): clazz for clazz in classes}
+    assert len(available_classes) == len(classes), "Ambiguous class names"
+    return available_classes
 
 
 FuzzyNames = typ.Union[str, typ.List[str]]
@@ -132,20 +147,74 @@ def get_selected_names(names: FuzzyNames, available_names: typ.Set[str]) -> typ.
     return selected_names
 
 
+# NOTE: The available classes only depend on the modules, so they
+#   are collected once rather than for every transpiled module.
+CHECKER_REGISTRY = get_available_classes(checkers._CHECKER_CLASSES)
+
+FIXER_REGISTRY = get_available_classes(fixers._FIXER_CLASSES)
+
+NamesKey = typ.Union[str, typ.Tuple[str, ...]]
+
+
+def _names_key(names: FuzzyNames) -> NamesKey:
+    if isinstance(names, str):
+        return names
+    else:
+        return tuple(names)
+
+
+@functools.lru_cache(maxsize=64)
+def _selected_checker_types(names: NamesKey) -> typ.Tuple[CheckerType, ...]:
+    names_arg = names if isinstance(names, str) else list(names)
+    selected_names = get_selected_names(names_arg, set(CHECKER_REGISTRY))
+    return tuple(typ.cast(CheckerType, CHECKER_REGISTRY[name]) for name in selected_names)
+
+
+@functools.lru_cache(maxsize=64)
+def _selected_fixer_types(
+    names: NamesKey, src_version: typ.Optional[str], tgt_version: typ.Optional[str]
+) -> typ.Tuple[FixerType, ...]:
+    names_arg = names if isinstance(names, str) else list(names)
+    selected_names = get_selected_names(names_arg, set(FIXER_REGISTRY))
+    fixer_types = [typ.cast(FixerType, FIXER_REGISTRY[name]) for name in selected_names]
+    if src_version is None or tgt_version is None:
+        return tuple(fixer_types)
+    else:
+        return tuple(
+            fixer_type
+            for fixer_type in fixer_types
+            if fixer_type.is_applicable_to(src_version, tgt_version)
+        )
+
+
 def iter_fuzzy_selected_checkers(names: FuzzyNames) -> typ.Iterable[checkers.CheckerBase]:
-    available_classes = get_available_classes(checkers, checkers.CheckerBase)
-    selected_names = get_selected_names(names, set(available_classes))
-    for name in selected_names:
-        checker_type = typ.cast(CheckerType, available_classes[name])
+    for checker_type in _selected_checker_types(_names_key(names)):
         yield checker_type()
 
 
-def iter_fuzzy_selected_fixers(names: FuzzyNames) -> typ.Iterable[fixers.FixerBase]:
-    available_classes = get_available_classes(fixers, fixers.FixerBase)
-    selected_names = get_selected_names(names, set(available_classes))
-    for name in selected_names:
-        fixer_type = typ.cast(FixerType, available_classes[name])
-        yield fixer_type()
+# NOTE: Fixers are reused for all modules of a build, rather than
+#   being instantiated for each module. Their per module state is
+#   cleared with FixerBase.reset before they are used.
+_FIXER_POOL: typ.Dict[FixerType, fixers.FixerBase] = {}
+
+
+def iter_fuzzy_selected_fixers(
+    names: FuzzyNames, src_version: typ.Optional[str] = None, tgt_version: typ.Optional[str] = None
+) -> typ.Iterable[fixers.FixerBase]:
+    """Iterate over the selected fixers.
+
+    If the versions are given, fixers which aren't applicable to
+    them are skipped, without being instantiated or reset.
+    """
+    fixer_types = _selected_fixer_types(_names_key(names), src_version, tgt_version)
+    for fixer_type in fixer_types:
+        fixer = _FIXER_POOL.get(fixer_type)
+        if fixer is None:
+            fixer = fixer_type()
+            _FIXER_POOL[fixer_type] = fixer
+        else:
+            fixer.reset()
+        yield fixer
 
 
 def parse_imports(tree: ast.Module) -> typ.Tuple[int, int, typ.Set[common.ImportDecl]]:
@@ -255,10 +324,33 @@ def add_module_declarations(tree: ast.Module, module_declarations: typ.Set[str])
         imports_end_offset += 1
 
 
-def transpile_module(cfg: common.BuildConfig, module_source: str) -> str:
+DEFAULT_FILENAME = "<unknown>"
+
+
+def transpile_module(
+    cfg: common.BuildConfig, module_source: str, filename: str = DEFAULT_FILENAME
+) -> str:
+    """Transpile module_source according to cfg.
+
+    The filename is only used for syntax errors.
+    """
+    fixed_module_body = _transpile_module_body(cfg, module_source, filename)
+    if fixed_module_body is None:
+        return module_source
+
+    coding, header = parse_module_header(module_source)
+    return header + fixed_module_body
+
+
+def _transpile_module_body(
+    cfg: common.BuildConfig, module_source: str, filename: str
+) -> typ.Optional[str]:
+    """Transpile module_source, without its header.
+
+    Returns None if the module doesn't have to be changed.
+    """
     checker_names: FuzzyNames = cfg.get("checkers", "")
     fixer_names: FuzzyNames = cfg.get("fixers", "")
-    module_tree = ast.parse(module_source)
     required_imports: typ.Set[common.ImportDecl] = set()
     module_declarations: typ.Set[str] = set()
 
@@ -266,29 +358,197 @@ def transpile_module(cfg: common.BuildConfig, module_source: str) -> str:
     src_version = f"{ver.major}.{ver.minor}"
     tgt_version = cfg.get("target_version", DEFAULT_TARGET_VERSION)
 
-    for checker in iter_fuzzy_selected_checkers(checker_names):
-        if checker.is_prohibited_for(tgt_version):
-            checker(cfg, module_tree)
-
-    for fixer in iter_fuzzy_selected_fixers(fixer_names):
-        if fixer.is_applicable_to(src_version, tgt_version):
+    selected_checkers = [
+        checker
+        for checker in iter_fuzzy_selected_checkers(checker_names)
+        if (
+            not checker.is_noop and
+            checker.is_prohibited_for(tgt_version) and
+            checker.is_triggered_by(module_source)
+        )
+    ]
+    triggered_fixers = [
+        fixer
+        for fixer in iter_fuzzy_selected_fixers(fixer_names, src_version, tgt_version)
+        if fixer.is_triggered_by(module_source)
+    ]
+
+    # NOTE: If neither checkers nor fixers are triggered by the
+    #   source, there is no need to even parse it. For Python 2
+    #   targets, the header may still need a coding declaration.
+    is_py3_target = common.parse_version(tgt_version) >= (3, 0)
+    if is_py3_target and not (selected_checkers or triggered_fixers):
+        return None
+
+    module_tree = ast.parse(module_source, filename=filename)
+
+    combined_checker = checkers.CombinedChecker(selected_checkers)
+    cache_dir = cfg.get("cache_dir")
+    if cache_dir:
+        cache_key = cache.check_result_key(cfg, module_source)
+        cache.cached_check(cache_dir, cache_key, lambda: combined_checker(cfg, module_tree))
+    else:
+        combined_checker(cfg, module_tree)
+
+    selected_fixers = [fixer for fixer in triggered_fixers if fixer.has_fix_targets(module_tree)]
+
+    # NOTE: All fixers implemented with visit_* methods are applied
+    #   using a single traversal of the tree, before any of the
+    #   other fixers. This is only valid as long as none of them
+    #   depends on changes made by one of the other fixers.
+    transformer_fixers = [
+        fixer for fixer in selected_fixers if isinstance(fixer, fixers.TransformerFixerBase)
+    ]
+    if transformer_fixers:
+        module_tree = fixers.FusedFixerPass(transformer_fixers)(cfg, module_tree)
+
+    for fixer in selected_fixers:
+        if not isinstance(fixer, fixers.TransformerFixerBase):
             maybe_fixed_module = fixer(cfg, module_tree)
             if maybe_fixed_module is None:
                 raise Exception(f"Error running fixer {type(fixer).__name__}")
-            required_imports.update(fixer.required_imports)
-            module_declarations.update(fixer.module_declarations)
             module_tree = maybe_fixed_module
+        required_imports.update(fixer.required_imports)
+        module_declarations.update(fixer.module_declarations)
 
     if any(required_imports):
         add_required_imports(module_tree, required_imports)
     if any(module_declarations):
         add_module_declarations(module_tree, module_declarations)
-    coding, header = parse_module_header(module_source)
-    return header + "".join(astor.to_source(module_tree))
+    return utils.to_source(module_tree)
+
+
+# NOTE: Identical modules (e.g. empty __init__.py files) are common,
+#   so results are memoized in process as well, in addition to the
+#   (optional) on-disk cache.
+TRANSPILE_MEMO_MAXSIZE = 256
+
+_transpile_memo: typ.Dict[str, bytes] = collections.OrderedDict()
+
+
+def _memo_lookup(
+    cfg: common.BuildConfig, module_source_data: bytes
+) -> typ.Tuple[str, typ.Optional[bytes]]:
+    memo_key = cache.transpile_result_key(cfg, module_source_data)
+    force = bool(int(cfg.get("force_transpile", "0")))
+    return memo_key, (None if force else _transpile_memo.get(memo_key))
+
+
+def _memo_store(memo_key: str, result: bytes) -> None:
+    _transpile_memo[memo_key] = result
+    if len(_transpile_memo) > TRANSPILE_MEMO_MAXSIZE:
+        # Evict the oldest entry
+        del _transpile_memo[next(iter(_transpile_memo))]
+
+
+def transpile_module_data(
+    cfg: common.BuildConfig, module_source_data: bytes, filename: str = DEFAULT_FILENAME
+) -> bytes:
+    memo_key, result = _memo_lookup(cfg, module_source_data)
+    if result is None:
+        result = _transpile_module_data_uncached(cfg, memo_key, module_source_data, filename)
+        _memo_store(memo_key, result)
+    return result
+
+
+def _transpile_module_data_uncached(
+    cfg: common.BuildConfig, memo_key: str, module_source_data: bytes, filename: str
+) -> bytes:
+    cache_dir = cfg.get("cache_dir")
+    if cache_dir:
+        force = bool(int(cfg.get("force_transpile", "0")))
+        return cache.cached_transpile(
+            cache_dir,
+            memo_key,
+            lambda: _transpile_module_data(cfg, module_source_data, filename),
+            force,
+        )
+    else:
+        return _transpile_module_data(cfg, module_source_data, filename)
 
 
-def transpile_module_data(cfg: common.BuildConfig, module_source_data: bytes) -> bytes:
+def _transpile_module_data(
+    cfg: common.BuildConfig, module_source_data: bytes, filename: str
+) -> bytes:
     coding, header = parse_module_header(module_source_data)
     module_source = module_source_data.decode(coding)
-    fixed_module_source = transpile_module(cfg, module_source)
-    return fixed_module_source.encode(coding)
+    fixed_module_body = _transpile_module_body(cfg, module_source, filename)
+    if fixed_module_body is None:
+        return module_source_data
+
+    # NOTE: Encoded separately, so the header and body are only
+    #   copied once, into the result.
+    return b"".join([header.encode(coding), fixed_module_body.encode(coding)])
+
+
+TranspileItem = typ.Tuple[common.BuildConfig, str, str, bytes]
+
+
+def _transpile_module_data_item(item: TranspileItem) -> bytes:
+    cfg, memo_key, filename, module_source_data = item
+    return _transpile_module_data_uncached(cfg, memo_key, module_source_data, filename)
+
+
+def _transpile_module_data_chunk(items: typ.List[TranspileItem]) -> typ.List[bytes]:
+    # NOTE: Worker processes don't run atexit handlers, so the
+    #   pending check results are written after each chunk.
+    try:
+        return [_transpile_module_data_item(item) for item in items]
+    finally:
+        cache.flush_check_results()
+
+
+def transpile_many(
+    cfg: common.BuildConfig,
+    module_sources: typ.Dict[str, bytes],
+    max_workers: int = 1,
+) -> typ.Dict[str, bytes]:
+    """Transpile multiple modules (by filename).
+
+    With max_workers > 1, the modules are distributed to a pool of
+    worker processes, each of which has its own instances of the
+    checkers and fixers. This is opt-in, since with the spawn start
+    method (the default on macOS and Windows) each worker imports
+    the __main__ module again, which for a setup.py without a
+    __main__ guard starts another build.
+    """
+    results: typ.Dict[str, bytes] = {}
+    # NOTE: The memo is checked here rather than in the workers,
+    #   which are too short lived to benefit from it. Modules with
+    #   identical sources are only transpiled once.
+    pending: typ.Dict[str, TranspileItem] = {}
+    pending_filenames: typ.Dict[str, typ.List[str]] = {}
+    for filename in sorted(module_sources):
+        module_source_data = module_sources[filename]
+        memo_key, result = _memo_lookup(cfg, module_source_data)
+        if result is not None:
+            results[filename] = result
+            continue
+
+        if memo_key not in pending:
+            pending[memo_key] = (cfg, memo_key, filename, module_source_data)
+        pending_filenames.setdefault(memo_key, []).append(filename)
+
+    items = list(pending.values())
+    pending_results: typ.List[bytes]
+    if max_workers > 1 and len(items) > 1:
+        # NOTE: Each worker gets its share of the modules in about
+        #   four chunks, so that workers which finish early can pick
+        #   up the remaining chunks of the others.
+        chunksize = max(1, len(items) // (4 * max_workers))
+        chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+        pool = cf.ProcessPoolExecutor(max_workers=max_workers, initializer=cache.reset_check_results)
+        with pool as executor:
+            pending_results = [
+                result
+                for chunk_results in executor.map(_transpile_module_data_chunk, chunks)
+                for result in chunk_results
+            ]
+    else:
+        pending_results = _transpile_module_data_chunk(items)
+
+    for (_, memo_key, _, _), result in zip(items, pending_results):
+        _memo_store(memo_key, result)
+        for filename in pending_filenames[memo_key]:
+            results[filename] = result
+    return results
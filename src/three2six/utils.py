@@ -4,11 +4,27 @@
 #
 # SPDX-License-Identifier:    MIT
 import ast
+import sys
 import astor
 import typing as typ
 from . import transpile
 
 
+if sys.version_info >= (3, 9):
+
+    def to_source(node: ast.AST) -> str:
+        # NOTE: ast.unparse is considerably faster than astor. Unlike
+        #   astor, it requires locations (for type comments) and the
+        #   source doesn't end with a newline.
+        ast.fix_missing_locations(node)
+        return ast.unparse(node) + "\n"
+
+else:
+
+    def to_source(node: ast.AST) -> str:
+        return astor.to_source(node)
+
+
 # Recursive types not fully supported yet, nested types replaced with "Any"
 # NodeOrNodelist = typ.Union[ast.AST, typ.List["NodeOrNodelist"]]
 NodeOrNodelist = typ.Union[ast.AST, typ.List[typ.Any]]
@@ -108,7 +124,7 @@ def parsedump_ast(code: str, mode="exec", **kwargs):
 
 def parsedump_source(code: str, mode="exec"):
     node = ast.parse(clean_whitespace(code), mode=mode)
-    return astor.to_source(node)
+    return to_source(node)
 
 
 def transpile_and_dump(module_str: str, cfg=None):
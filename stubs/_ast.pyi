@@ -257,6 +257,10 @@ class NameConstant(expr):
 
 class Ellipsis(expr): ...
 
+if sys.version_info >= (3, 6):
+    class Constant(expr):
+        value = ...  # type: Any
+
 class Attribute(expr):
     value = ...  # type: expr
     attr = ...  # type: _identifier
@@ -22,5 +22,6 @@ def iter_child_nodes(node: AST) -> Iterator[AST]: ...
 def iter_fields(node: AST) -> Iterator[typing.Tuple[str, Any]]: ...
 def literal_eval(node_or_string: Union[str, AST]) -> Any: ...
 def walk(node: AST) -> Iterator[AST]: ...
+def unparse(ast_obj: AST) -> str: ...
 
 PyCF_ONLY_AST = ...  # type: int
\ No newline at end of file
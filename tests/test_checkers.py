@@ -3,6 +3,8 @@ import pytest
 
 from three2six.common import CheckError
 from three2six import utils
+from three2six import checkers
+from three2six import transpile
 
 from collections import namedtuple
 
@@ -201,6 +203,14 @@ FIXTURES = [
         """,
         "Prohibited keyword argument 'encoding' to builtin.open.",
     ),
+    CheckFixture(
+        "no_open_with_encoding",
+        """
+        with open(filepath, "rb", **kwargs) as fh:
+            fh.read()
+        """,
+        None,
+    ),
     CheckFixture(
         "no_star_imports",
         """
@@ -208,6 +218,35 @@ FIXTURES = [
         """,
         "Prohibited from math import *.",
     ),
+    CheckFixture(
+        "no_star_imports,no_async_await,no_overridden_builtins",
+        """
+        from math import pi
+        async def foo():
+            await bar()
+        """,
+        "Prohibited use of async/await",
+    ),
+    CheckFixture(
+        "no_overridden_builtins,no_star_imports",
+        """
+        from math import *
+        def len(x):
+            return x
+        """,
+        "Prohibited from math import *.",
+    ),
+    CheckFixture(
+        "no_star_imports",
+        """
+        try:
+            import math
+        except ImportError:
+            if True:
+                from cmath import *
+        """,
+        "Prohibited from cmath import *.",
+    ),
     CheckFixture(
         "no_complex_named_tuple",
         """
@@ -239,6 +278,16 @@ FIXTURES = [
         """,
         "Prohibited use of default value for field 'baz' of class 'Foo'",
     ),
+    CheckFixture(
+        "no_complex_named_tuple",
+        """
+        class Foo(typ.NamedTuple):
+            bar: int
+            baz: int = 1
+        import typing as typ
+        """,
+        "Prohibited use of default value for field 'baz' of class 'Foo'",
+    ),
 ]
 
 
@@ -268,3 +317,23 @@ def test_checkers(fixture):
         for expected_error_msg in expected_error_messages:
             print("???", repr(expected_error_msg))
             assert expected_error_msg in str(result_error)
+
+
+def test_is_prohibited_for():
+    checker = checkers.NoAsyncAwait()
+    assert checker.is_prohibited_for("2.7")
+    assert checker.is_prohibited_for("3.4")
+    assert checker.is_prohibited_for("3.4.10")
+    assert not checker.is_prohibited_for("3.5")
+    assert not checker.is_prohibited_for("3.10")
+
+
+def test_trigger_tokens():
+    assert checkers.NoAsyncAwait().is_triggered_by("async def foo(): pass")
+    assert not checkers.NoAsyncAwait().is_triggered_by("def foo(): pass")
+    assert checkers.NoOverriddenBuiltinsChecker().is_triggered_by("def foo(): pass")
+
+
+def test_checker_slots():
+    for checker in transpile.iter_fuzzy_selected_checkers(""):
+        assert not hasattr(checker, "__dict__"), type(checker).__name__
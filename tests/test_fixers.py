@@ -1,8 +1,11 @@
 import sys
+import ast
 from collections import namedtuple
 
 import pytest
 
+from three2six import common
+from three2six import fixers
 from three2six import transpile
 from three2six import utils
 
@@ -59,6 +62,104 @@ def test_header_preserved():
     assert expected_ast == result_ast
 
 
+def test_version_comparison():
+    fixer = fixers.RemoveAnnAssignFixer()
+    assert fixer.is_required_for("2.7")
+    assert fixer.is_required_for("3.5")
+    assert not fixer.is_required_for("3.6")
+    assert not fixer.is_required_for("3.10")
+
+
+def test_fixer_slots():
+    for fixer in transpile.iter_fuzzy_selected_fixers(""):
+        assert not hasattr(fixer.version_info, "__dict__"), type(fixer).__name__
+        if not isinstance(fixer, fixers.TransformerFixerBase):
+            assert not hasattr(fixer, "__dict__"), type(fixer).__name__
+
+
+def test_fused_pass_invalid_hook_result():
+    class RemovePassFixer(fixers.TransformerFixerBase):
+        def visit_Pass(self, node):
+            return None
+
+    tree = ast.parse("def foo():\n    pass\n")
+    with pytest.raises(common.FixerError) as excinfo:
+        fixers.FusedFixerPass([RemovePassFixer()])({}, tree)
+    assert "RemovePassFixer returned NoneType" in excinfo.value.msg
+    assert excinfo.value.module is tree
+
+
+def test_fused_pass_stmts_only():
+    fixer_pass = fixers.FusedFixerPass([fixers.NamedTupleClassToAssignFixer()])
+    assert fixer_pass.stmts_only
+    fixer_pass = fixers.FusedFixerPass([fixers.NewStyleClassesFixer()])
+    assert fixer_pass.stmts_only
+    tree = ast.parse(utils.clean_whitespace("""
+    def foo():
+        try:
+            pass
+        except Exception:
+            class Foo:
+                pass
+        return [x for x in range(3)]
+    """))
+    tree = fixer_pass({}, tree)
+    class_node = tree.body[0].body[0].handlers[0].body[0]
+    assert [base.id for base in class_node.bases] == ["object"]
+
+    fixer_pass = fixers.FusedFixerPass([
+        fixers.NewStyleClassesFixer(),
+        fixers.XrangeToRangeFixer(),
+    ])
+    assert not fixer_pass.stmts_only
+
+
+def test_has_fix_targets():
+    fixer = fixers.RemoveFunctionDefAnnotationsFixer()
+    assert not fixer.has_fix_targets(ast.parse("def foo(a, b=1, *args): pass"))
+    assert fixer.has_fix_targets(ast.parse("def foo(a, *args: int): pass"))
+    assert fixer.has_fix_targets(ast.parse("def foo() -> int: pass"))
+
+    fixer = fixers.InlineKWOnlyArgsFixer()
+    assert not fixer.has_fix_targets(ast.parse("def foo(a, *args): pass"))
+    assert fixer.has_fix_targets(ast.parse("def foo(a, *, b=1): pass"))
+
+
+def test_unpacking_generalizations_deeply_nested():
+    # NOTE: Deeper than the default recursion limit. The call is the
+    #   leftmost operand, so it is at the bottom of the nested BinOps
+    #   and the whole depth has to be walked to reach it.
+    test_source = "x = " + " + ".join(["fn(*a, *b)"] + ["a"] * 2000) + "\n"
+    tree = ast.parse(test_source)
+    tree = fixers.UnpackingGeneralizationsFixer()({}, tree)
+    node = tree.body[0].value
+    depth = 0
+    while isinstance(node, ast.BinOp):
+        node = node.left
+        depth += 1
+    assert depth == 2000
+    assert isinstance(node, ast.Call)
+    assert len(node.args) == 1
+    assert isinstance(node.args[0].value, ast.BinOp)
+
+
+def test_unpacking_generalizations_untouched_subtrees():
+    test_source = "x = [a, b]\nfn(*a, *b)\n"
+    tree = ast.parse(test_source)
+    assign_node = tree.body[0]
+    fixer = fixers.UnpackingGeneralizationsFixer()
+    tree = fixer({}, tree)
+    assert tree.body[0] is assign_node
+    assert fixer._relevant_ids is None
+    call_node = tree.body[1].value
+    assert len(call_node.args) == 1
+
+    tree = ast.parse("fn(**dict(**{'a': 1}))\n")
+    tree = fixer({}, tree)
+    keyword_node = tree.body[0].value.keywords[0]
+    assert isinstance(keyword_node.value, ast.Dict)
+
+
 FIXTURES = [
     FixerFixture(
         [
@@ -208,6 +309,22 @@ FIXTURES = [
             pass
         """,
     ),
+    FixerFixture(
+        "new_style_classes,remove_function_def_annotations",
+        "2.7",
+        """
+        class Foo:
+            class Bar:
+                def baz(self) -> int:
+                    return 1
+        """,
+        """
+        class Foo(object):
+            class Bar(object):
+                def baz(self):
+                    return 1
+        """,
+    ),
     FixerFixture(
         "new_style_classes",
         "3.4",
@@ -299,6 +416,28 @@ FIXTURES = [
                 return super(FooClass, self).foo_method(arg, *args, **kwargs)
         """,
     ),
+    FixerFixture(
+        "short_to_long_form_super",
+        "2.7",
+        """
+        class FooClass:
+            class BarClass:
+                def bar_method(this):
+                    return super().bar_method()
+
+            def foo_method(self):
+                return super().foo_method()
+        """,
+        """
+        class FooClass:
+            class BarClass:
+                def bar_method(this):
+                    return super(BarClass, this).bar_method()
+
+            def foo_method(self):
+                return super(FooClass, self).foo_method()
+        """,
+    ),
     FixerFixture(
         "short_to_long_form_super",
         "3.4",
@@ -1,3 +1,10 @@
+import sqlite3
+
+import pytest
+
+from three2six import cache
+from three2six import common
+from three2six import fixers
 from three2six import transpile
 from three2six.utils import clean_whitespace
 
@@ -26,3 +33,216 @@ def test_parse_header_coding():
     coding, header = transpile.parse_module_header(source_data)
     assert coding == "shift_jis"
     assert header == "# coding: shift_jis\n# 今日は\n"
+
+
+def test_parse_header_crlf():
+    source_data = "#!/usr/bin/env python\r\n# coding: latin-1\r\n# Grüße\r\nx = 1\r\n".encode("latin-1")
+    coding, header = transpile.parse_module_header(source_data)
+    assert coding == "latin-1"
+    assert header == "#!/usr/bin/env python\n# coding: latin-1\n# Grüße\n"
+
+
+def test_syntax_error_filename():
+    with pytest.raises(SyntaxError) as excinfo:
+        transpile.transpile_module_data({}, b"x = (\n", "foo/bar.py")
+    assert excinfo.value.filename == "foo/bar.py"
+
+
+def test_cached_check(tmpdir):
+    cfg = {"checkers": "no_star_imports", "cache_dir": str(tmpdir)}
+    source = "from math import *\n"
+
+    for _ in range(2):
+        with pytest.raises(common.CheckError) as excinfo:
+            transpile.transpile_module(cfg, source)
+        assert "Prohibited from math import *." in str(excinfo.value)
+
+    cache_key = cache.check_result_key(cfg, source)
+    calls = []
+    with pytest.raises(common.CheckError):
+        cache.cached_check(str(tmpdir), cache_key, lambda: calls.append(1))
+    assert calls == []
+
+    ok_source = "from math import pi\n"
+    transpile.transpile_module(cfg, ok_source)
+    ok_cache_key = cache.check_result_key(cfg, ok_source)
+    cache.cached_check(str(tmpdir), ok_cache_key, lambda: calls.append(1))
+    assert calls == []
+
+
+def test_cached_check_batched(tmpdir):
+    cache_dir = str(tmpdir)
+    assert cache._connection(cache_dir) is cache._connection(cache_dir)
+
+    cache.cached_check(cache_dir, "ok-key", lambda: None)
+    db_path = str(tmpdir.join(cache.CHECK_RESULTS_FILENAME))
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM check_results").fetchone() == (0,)
+
+    # Pending results are used before they are written
+    cache.cached_check(cache_dir, "ok-key", lambda: 1 / 0)
+
+    cache.flush_check_results()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT * FROM check_results").fetchall() == [("ok-key", None)]
+
+
+def test_flush_check_results_removed_dir(tmpdir):
+    cache_dir = str(tmpdir.join("removed"))
+    cache.cached_check(cache_dir, "ok-key", lambda: None)
+    tmpdir.join("removed").remove()
+    cache.flush_check_results()
+    assert not tmpdir.join("removed").exists()
+
+    cache.cached_check(cache_dir, "other-key", lambda: None)
+    cache.reset_check_results()
+    cache.flush_check_results()
+    assert not tmpdir.join("removed").exists()
+
+
+def test_fixer_reuse():
+    cfg = {"fixers": "itertools_builtins", "target_version": "2.7"}
+    result = transpile.transpile_module(cfg, "x = map(str, [1])\n")
+    assert "import itertools" in result
+
+    result = transpile.transpile_module(cfg, "x = 1\n")
+    assert "itertools" not in result
+
+
+def test_registries():
+    assert "nostarimports" in transpile.CHECKER_REGISTRY
+    assert "newstyleclasses" in transpile.FIXER_REGISTRY
+    registered_names = set(transpile.CHECKER_REGISTRY) | set(transpile.FIXER_REGISTRY)
+    assert not any(name.endswith("base") for name in registered_names)
+
+
+def test_version_selected_fixers():
+    all_fixers = list(transpile.iter_fuzzy_selected_fixers(""))
+    py27_fixers = list(transpile.iter_fuzzy_selected_fixers("", "3.6", "2.7"))
+
+    assert 0 < len(py27_fixers) <= len(all_fixers)
+    for fixer in all_fixers:
+        is_applicable = fixer.is_applicable_to("3.6", "2.7")
+        assert (fixer in py27_fixers) == is_applicable
+
+
+def test_single_fixer_pass(monkeypatch):
+    calls = []
+    apply_hooks = fixers.FusedFixerPass.apply_hooks
+
+    def counting_apply_hooks(self, tree):
+        calls.append(len(self.fixers))
+        return apply_hooks(self, tree)
+
+    monkeypatch.setattr(fixers.FusedFixerPass, "apply_hooks", counting_apply_hooks)
+    cfg = {
+        "fixers": "new_style_classes,remove_ann_assign,remove_function_def_annotations",
+        "target_version": "2.7",
+    }
+    source = clean_whitespace("""
+    class Foo:
+        x: int = 1
+
+        def foo(self, a: int) -> None:
+            pass
+    """)
+    result = transpile.transpile_module(cfg, source)
+    assert "class Foo(object):" in result
+    assert "int" not in result
+    assert calls == [3]
+
+
+def test_cached_transpile(tmpdir, monkeypatch):
+    cfg = {"target_version": "2.7", "cache_dir": str(tmpdir)}
+    source_data = b"class Foo:\n    pass\n"
+    result = transpile.transpile_module_data(cfg, source_data)
+    assert b"class Foo(object):" in result
+
+    def fail(*args):
+        raise AssertionError("Transpiled despite cached result")
+
+    monkeypatch.setattr(transpile, "_transpile_module_body", fail)
+    assert transpile.transpile_module_data(cfg, source_data) == result
+
+    with pytest.raises(AssertionError):
+        transpile.transpile_module_data(dict(cfg, force_transpile="1"), source_data)
+    with pytest.raises(AssertionError):
+        transpile.transpile_module_data(dict(cfg, target_version="3.4"), source_data)
+
+
+def test_transpile_result_key_interpreter(monkeypatch):
+    cfg = {"target_version": "2.7"}
+    key = cache.transpile_result_key(cfg, b"x = 1\n")
+    monkeypatch.setattr(cache, "INTERPRETER_TAG", "otherpython-3.5")
+    assert cache.transpile_result_key(cfg, b"x = 1\n") != key
+
+
+def test_cache_keys_code_and_cache_dir(monkeypatch):
+    cfg = {"target_version": "2.7", "cache_dir": "/tmp/a"}
+    key = cache.transpile_result_key(cfg, b"x = 1\n")
+    check_key = cache.check_result_key(cfg, "x = 1\n")
+    other_cfg = dict(cfg, cache_dir="/tmp/b")
+    assert cache.transpile_result_key(other_cfg, b"x = 1\n") == key
+    assert cache.check_result_key(other_cfg, "x = 1\n") == check_key
+
+    monkeypatch.setattr(cache, "_package_source_hash", lambda: "changed")
+    assert cache.transpile_result_key(cfg, b"x = 1\n") != key
+    assert cache.check_result_key(cfg, "x = 1\n") != check_key
+
+
+def test_transpile_many():
+    cfg = {"fixers": "new_style_classes", "target_version": "2.7"}
+    module_sources = {
+        "a.py": b"class A:\n    pass\n",
+        "b.py": b"class B:\n    pass\n",
+        "c.py": b"x = 1\n",
+    }
+    expected = {
+        filename: transpile.transpile_module_data(cfg, source_data)
+        for filename, source_data in module_sources.items()
+    }
+    assert transpile.transpile_many(cfg, module_sources, max_workers=2) == expected
+    assert transpile.transpile_many(cfg, module_sources, max_workers=1) == expected
+    assert b"class A(object):" in expected["a.py"]
+
+
+def test_transpile_many_serial_default(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Process pool used without opt-in")
+
+    monkeypatch.setattr(transpile.cf, "ProcessPoolExecutor", fail)
+    cfg = {"fixers": "new_style_classes", "target_version": "2.7"}
+    module_sources = {
+        "a/__init__.py": b"class Dup:\n    pass\n",
+        "b/__init__.py": b"class Dup:\n    pass\n",
+    }
+    results = transpile.transpile_many(cfg, module_sources)
+    assert results["a/__init__.py"] == results["b/__init__.py"]
+    assert b"class Dup(object):" in results["a/__init__.py"]
+
+    # Memoized results are not sent to workers either
+    assert transpile.transpile_many(cfg, module_sources, max_workers=2) == results
+
+
+def test_untriggered_module_unchanged():
+    cfg = {"target_version": "3.4", "checkers": "no_star_imports"}
+    source = "# comment\nx = [1] + [2]\n"
+    assert transpile.transpile_module(cfg, source) == source
+
+    source_data = source.encode("utf-8")
+    assert transpile.transpile_module_data(cfg, source_data) is source_data
+
+    source = "fn(**a, **b)\n"
+    assert transpile.transpile_module(cfg, source) != source
+
+
+def test_transpile_memo(monkeypatch):
+    cfg = {"fixers": "new_style_classes", "target_version": "2.7"}
+    source_data = b"class Memo:\n    pass\n"
+    result = transpile.transpile_module_data(cfg, source_data, "a/__init__.py")
+
+    def fail(*args):
+        raise AssertionError("Transpiled despite memoized result")
+
+    monkeypatch.setattr(transpile, "_transpile_module_body", fail)
+    assert transpile.transpile_module_data(cfg, source_data, "b/__init__.py") == result